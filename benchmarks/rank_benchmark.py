@@ -0,0 +1,130 @@
+"""
+排名计算性能对比：旧版 calc_rank 与 ranking.rank_table
+用法: python benchmarks/rank_benchmark.py [学生数] [学科数]
+"""
+import copy
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "OneBotZX"))
+
+from ranking import rank_table  # noqa: E402
+from scores import StudentScoreInfo, ExamScoreTable  # noqa: E402
+
+
+def calc_rank(student_list):
+    """旧版实现（teacher.calc_rank），仅用于对比"""
+    def parse_score(score_str):
+        if isinstance(score_str, (int, float)):
+            return float(score_str)
+        score_str = str(score_str)
+        if "剔除" in score_str:
+            numbers = re.findall(r'-?\d+\.?\d*', score_str)
+            if numbers:
+                try:
+                    return float(numbers[0])
+                except ValueError:
+                    return -1
+            return -1
+        try:
+            return float(score_str)
+        except (ValueError, TypeError):
+            return -1
+
+    subject_scores = {}
+    for student in student_list:
+        for subject_name, score_obj in student.scores.items():
+            if subject_name not in subject_scores:
+                subject_scores[subject_name] = []
+            subject_scores[subject_name].append((student, score_obj))
+
+    for subject_name, scores in subject_scores.items():
+        class_groups = {}
+        for student, score_obj in scores:
+            if student.class_name not in class_groups:
+                class_groups[student.class_name] = []
+            class_groups[student.class_name].append((student, score_obj))
+
+        sorted_scores = sorted(scores, key=lambda x: parse_score(x[1].score), reverse=True)
+        current_rank = 1
+        prev_score = None
+        for i, (student, score_obj) in enumerate(sorted_scores):
+            current_score = parse_score(score_obj.score)
+            if current_score == -1:
+                score_obj.schoolrank = len(sorted_scores)
+            else:
+                if prev_score is not None and current_score != prev_score:
+                    current_rank = i + 1
+                score_obj.schoolrank = current_rank
+            prev_score = current_score
+
+        for class_name, class_scores in class_groups.items():
+            sorted_class_scores = sorted(class_scores, key=lambda x: parse_score(x[1].score), reverse=True)
+            current_rank = 1
+            prev_score = None
+            for i, (student, score_obj) in enumerate(sorted_class_scores):
+                current_score = parse_score(score_obj.score)
+                if current_score == -1:
+                    score_obj.classrank = len(sorted_class_scores)
+                else:
+                    if prev_score is not None and current_score != prev_score:
+                        current_rank = i + 1
+                    score_obj.classrank = current_rank
+                prev_score = current_score
+
+
+def random_score(full_score):
+    value = random.random()
+    if value < 0.02:
+        return "缺考"
+    if value < 0.04:
+        return f"剔除({random.randint(0, full_score)})"
+    if value < 0.5:
+        return str(random.randint(0, full_score))  # 整数分数容易出现并列
+    return str(round(random.uniform(0, full_score), 1))
+
+
+def make_students(count, subject_count):
+    students = []
+    for i in range(count):
+        student = StudentScoreInfo(f"学生{i}", f"user{i}", "", f"{i % 20 + 1}班",
+                                   str(random.randint(0, subject_count * 150)), "-", "-")
+        for j in range(subject_count):
+            if random.random() < 0.95:  # 部分学生未选考该学科
+                student.add_subject_score(f"学科{j}", random_score(150), "-", "-", f"{j:02d}")
+        students.append(student)
+    return students
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    subject_count = int(sys.argv[2]) if len(sys.argv) > 2 else 9
+    random.seed(0)
+    students = make_students(count, subject_count)
+
+    legacy_students = copy.deepcopy(students)
+    start = time.perf_counter()
+    calc_rank(legacy_students)
+    legacy_time = time.perf_counter() - start
+
+    table = ExamScoreTable(students)
+    start = time.perf_counter()
+    rank_table(table)
+    new_time = time.perf_counter() - start
+
+    for expected, actual in zip(legacy_students, table):
+        for name, score in expected.scores.items():
+            got = actual.scores[name]
+            assert (got.classrank, got.schoolrank) == (score.classrank, score.schoolrank), \
+                f"{expected.username} {name}: {got.classrank}/{got.schoolrank} != {score.classrank}/{score.schoolrank}"
+
+    print(f"{count} students, {subject_count} subjects: results identical")
+    print(f"calc_rank:  {legacy_time * 1000:.1f} ms")
+    print(f"rank_table: {new_time * 1000:.1f} ms ({legacy_time / new_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
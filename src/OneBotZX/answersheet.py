@@ -1,13 +1,72 @@
+import hashlib
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 
 import requests
+from loguru import logger
 from PIL import Image, ImageDraw, ImageFont
+from requests.adapters import HTTPAdapter
 
+from cache_manager import cache_manager
 from config_loader import assets_config
 from models import ZhixueError
 
+assets_config.check_font_path()
 font_path = assets_config.font_path
 
+SHEET_CACHE_DIR = "./.zx/cache/sheets"
+DOWNLOAD_WORKERS = 4
+
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+
+def get_sheet_cache_path(image_url):
+    return f"{SHEET_CACHE_DIR}/{hashlib.sha1(image_url.encode()).hexdigest()}"
+
+
+def fetch_sheet_image(image_url) -> bytes:
+    """
+    获取原卷图片，优先读取本地缓存
+    Args:
+        image_url: 原卷链接
+    Return:
+        bytes: 图片内容
+    """
+    path = get_sheet_cache_path(image_url)
+    if cache_manager.lookup(path):
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError as e:
+            logger.warning(f"Failed to read sheet cache {path}: {e}")
+    response = session.get(image_url, timeout=30)
+    response.raise_for_status()
+    os.makedirs(SHEET_CACHE_DIR, exist_ok=True)
+    # 同一原卷可能被多个任务同时获取，各自写入唯一的临时文件
+    fd, tmp_path = tempfile.mkstemp(dir=SHEET_CACHE_DIR, prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(response.content)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    cache_manager.add(path)
+    return response.content
+
+
+def download_sheet_images(sheet_images) -> list:
+    """并发获取答题卡全部页面的原卷图片，返回顺序与 sheet_images 一致"""
+    if not sheet_images:
+        return []
+    with ThreadPoolExecutor(max_workers=min(len(sheet_images), DOWNLOAD_WORKERS)) as pool:
+        return list(pool.map(fetch_sheet_image, sheet_images))
+
 def get_size(text, font):
     left, top, right, bottom = font.getbbox(text, "utf-8")
     width = right - left
@@ -59,9 +118,8 @@ def draw_details(image, text, font, x, y, color, cnt):
 
 def draw_answersheet(topic_mapping, page_positions, objective_answer, answer_details, sheet_images, paper_type):
     images = []
-    for i, image_url in enumerate(sheet_images):
-        response = requests.get(image_url)
-        image = Image.open(BytesIO(response.content))
+    for i, image_content in enumerate(download_sheet_images(sheet_images)):
+        image = Image.open(BytesIO(image_content))
         image = image.convert("RGB")
         draw = ImageDraw.Draw(image)
         font = ImageFont.truetype(font_path, 25, encoding="utf-8")
@@ -1,27 +1,54 @@
 import os
-import time
+import threading
 from functools import wraps
 from queue import Queue
 
-from flask import Flask, request
-from flask_limiter import Limiter
-from loguru import logger
-
-import zhixue
-from config_loader import message_config
-from filesystem import load_ban_list, save_ban_list, clean_cache_data, clean_cache_file
-from msg import send_private_message, send_private_file, send_private_img, approve_friend_request
-from models import CommandError
+from startup import import_timer, get_startup_report, log_startup_report
+
+with import_timer("flask"):
+    from flask import Flask, request
+with import_timer("flask_limiter"):
+    from flask_limiter import Limiter
+    from limits import parse
+    from limits.storage import MemoryStorage
+    from limits.strategies import FixedWindowRateLimiter
+with import_timer("flask_sock"):
+    from flask_sock import Sock
+from loguru import logger  # 已由 startup 导入
+
+with import_timer("config_loader"):
+    from config_loader import message_config, onebot_config
+with import_timer("cache_manager"):
+    from cache_manager import cache_manager
+with import_timer("filesystem"):
+    from filesystem import clean_cache_data, clean_cache_file
+with import_timer("msg"):
+    from msg import send_private_message, send_private_file, send_private_img, approve_friend_request, \
+        start_dispatcher, get_send_stats, set_ws_transport, bind_self_id
+with import_timer("jobs"):
+    from jobs import job_queue, check_cancelled
+with import_timer("models"):
+    from models import CommandError, JobCancelled
+with import_timer("persistence"):
+    from persistence import start_write_behind, get_write_stats
+with import_timer("singleflight"):
+    from singleflight import flights
+with import_timer("store"):
+    from store import state_store
+with import_timer("ws_transport"):
+    from ws_transport import ForwardWebSocket, ReverseWebSocket
+with import_timer("zhixue"):
+    import zhixue
 
 # Config Start
 chat_prefix = message_config.chat_prefix
 admins = message_config.admins
 super_users = message_config.super_users
-reply_limit = message_config.reply_limit
 max_reply = message_config.max_reply
 
 wait_for_login = {}
 ban_list = []
+event_lock = threading.Lock()
 
 logger.add(f"./.zx/log/zxbot.log", encoding="utf-8", rotation="00:00", enqueue=True)
 # Config End
@@ -38,56 +65,96 @@ def get_sender_id():
 
 
 limiter = Limiter(app=app, key_func=get_sender_id, default_limits=[])
-queue = Queue()
-
-
-@app.before_request
-def queue_requests():
-    queue.put(time.time())
-
 
-@app.after_request
-def process_queue(response):
-    current_time = time.time()
-    request_time = queue.get()
 
-    wait_time = reply_limit - (current_time - request_time)
-    if wait_time > 0:
-        time.sleep(wait_time)
-
-    return response
-
-
-def should_limit():
+def is_command(request_data):
     try:
-        message = request.get_json().get("message", [])[0].get("data", {}).get("text", "")
+        message = request_data.get("message", [])[0].get("data", {}).get("text", "")
     except Exception:
         return False
-    return not message.startswith(chat_prefix)
+    return message.startswith(chat_prefix)
+
+
+def should_limit():
+    return not is_command(request.get_json())
 
 
 @app.route("/", methods=["POST"])
 @limiter.limit("20 per 5 minutes", exempt_when=should_limit)
 @limiter.limit("50 per hour", exempt_when=should_limit)
 def handle_request():
-    request_data = request.get_json()
-    if str(request_data.get("sender", {}).get("user_id", "")) in rate_limit_status:
-        del rate_limit_status[str(request_data.get("sender", {}).get("user_id", ""))]
-
-    if request_data.get("post_type") == "request" and request_data.get("request_type") == "friend":
-        handle_friend_request(request_data)
-
-    if request_data.get("post_type") == "message" or request_data.get("post_type") == "message_sent":
-        handle_message(request_data)
-
+    # 事件交由 event_worker 处理，立即应答 OneBot 实现
+    event_queue.put((request.get_json(), False))
     return '', 204
 
 
 @app.errorhandler(429)
 def ratelimit_handler(e):
     sender_id = str(request.get_json().get("sender", {}).get("user_id", ""))
-    if sender_id in ban_list:
+    if int(sender_id) in ban_list:
         return '', 403
+    on_rate_limited(sender_id)
+    return '', 429
+
+# Flask Config End
+
+
+# WebSocket Config Start
+ws_rate_limiter = FixedWindowRateLimiter(MemoryStorage())
+ws_rate_limits = [parse("20 per 5 minutes"), parse("50 per hour")]
+event_queue = Queue()  # (事件, 是否需要检查频率限制)
+
+
+def on_ws_event(request_data):
+    event_queue.put((request_data, True))
+
+
+def event_worker():
+    """依次处理 HTTP 与 WebSocket 收到的事件，WebSocket 事件使用与 HTTP 相同的频率限制"""
+    while True:
+        request_data, check_limit = event_queue.get()
+        try:
+            bind_self_id(request_data.get("self_id"))  # 频率限制提示也需由收到事件的机器人发送
+            sender_id = str(request_data.get("sender", {}).get("user_id", ""))
+            # 每个时间窗口都需计数，不能在第一个超限的窗口处停止
+            if check_limit and is_command(request_data) and \
+                    not all([ws_rate_limiter.hit(limit, sender_id) for limit in ws_rate_limits]):
+                if int(sender_id) not in ban_list:
+                    on_rate_limited(sender_id)
+                continue
+            handle_event(request_data)
+        except Exception:
+            logger.exception("An error occurred when handling event")
+
+
+def start_forward_ws():
+    ws = ForwardWebSocket(onebot_config.ws_url, onebot_config.access_token, on_ws_event)
+    set_ws_transport(ws)
+    ws.start()
+
+
+def handle_reverse_ws(ws):
+    """反向 WebSocket：OneBot 实现连接到本机，按 X-Self-ID 区分不同机器人账号"""
+    self_id = request.headers.get("X-Self-ID", "")
+    token = request.headers.get("Authorization", "").removeprefix("Bearer ").strip() or \
+        request.args.get("access_token", "")
+    if onebot_config.access_token and token != onebot_config.access_token:
+        logger.warning(f"Rejected reverse websocket from {request.remote_addr}: invalid access token")
+        return
+    if not self_id:
+        logger.warning(f"Rejected reverse websocket from {request.remote_addr}: missing X-Self-ID")
+        return
+    ReverseWebSocket(ws, self_id, on_ws_event).serve()
+
+
+if onebot_config.reverse_ws_path:
+    sock = Sock(app)
+    sock.route(onebot_config.reverse_ws_path)(handle_reverse_ws)
+
+# WebSocket Config End
+
+
+def on_rate_limited(sender_id):
     if sender_id not in rate_limit_status:
         rate_limit_status[sender_id] = 0
         send_private_message(sender_id, "已触发请求数量限制，请 10 分钟后再试。多次触发将导致封禁。")
@@ -95,12 +162,23 @@ def ratelimit_handler(e):
     rate_limit_status[sender_id] += 1
     if rate_limit_status[sender_id] >= max_reply:
         ban_list.append(int(sender_id))
-        save_ban_list(ban_list)
+        state_store.add_ban(sender_id)
         send_private_message(sender_id, "因多次触发请求频率限制，已被封禁。请联系管理员。")
         logger.warning(f"{sender_id} has been banned due to frequent requests.")
-    return '', 429
 
-# Flask Config End
+
+def handle_event(request_data):
+    """处理 OneBot 事件，HTTP 与 WebSocket 收到的事件逐个处理"""
+    with event_lock:
+        bind_self_id(request_data.get("self_id"))
+        if str(request_data.get("sender", {}).get("user_id", "")) in rate_limit_status:
+            del rate_limit_status[str(request_data.get("sender", {}).get("user_id", ""))]
+
+        if request_data.get("post_type") == "request" and request_data.get("request_type") == "friend":
+            handle_friend_request(request_data)
+
+        if request_data.get("post_type") == "message" or request_data.get("post_type") == "message_sent":
+            handle_message(request_data)
 
 
 def require_login(f: callable):
@@ -112,6 +190,41 @@ def require_login(f: callable):
     return wrapper
 
 
+def report_error(sender_id, message, e: Exception):
+    """向用户回复指令执行中的错误"""
+    if isinstance(e, CommandError):
+        send_private_message(sender_id, str(e))
+        return
+    if int(sender_id) in admins:
+        send_private_message(sender_id, f"发生错误: {str(e)[:100]}")
+    else:
+        send_private_message(sender_id, "发生未知错误，请联系管理员。")
+    logger.opt(exception=e).error(f"An error occurred when handling {message}")
+
+
+def submit_job(sender_id, name, func: callable, *args):
+    """将耗时指令加入任务队列，立即回复排队位置，执行结果由任务发送"""
+    def run():
+        try:
+            func(*args)
+        except JobCancelled:
+            raise
+        except Exception as e:
+            report_error(sender_id, name, e)
+
+    job, position = job_queue.submit(sender_id, name, run)
+    if position:
+        send_private_message(sender_id, f"任务 #{job.id} 已加入队列，前面还有 {position} 个任务，完成后将自动发送结果。")
+    else:
+        send_private_message(sender_id, f"任务 #{job.id} 正在处理，完成后将自动发送结果。")
+
+
+def send_images(sender_id, file_paths):
+    for file_path in file_paths:
+        check_cancelled()
+        send_private_img(sender_id, f"file://{os.path.abspath(file_path)}")
+
+
 def handle_help_request(sender_id, message):
     send_private_message(sender_id, f"帮助信息：\n"
                                     f"{chat_prefix} login <学生账号> <密码> - 登录学生账号\n"
@@ -130,13 +243,22 @@ def handle_help_request(sender_id, message):
         send_private_message(sender_id, f"欢迎您，管理员 {sender_id}：\n"
                                         f"{chat_prefix} admin rm data <stu_list|tch_list|exam_scores|all> - 清除缓存数据\n"
                                         f"{chat_prefix} admin rm cache - 清除缓存\n"
+                                        f"{chat_prefix} admin cache - 查看缓存占用及命中率\n"
                                         f"{chat_prefix} admin ban <add|rm> <QQ 号> - 禁用或解禁用户\n"
                                         f"{chat_prefix} admin forcelogout <QQ 号> - 强制登出 QQ 对应的学生账号\n"
                                         f"{chat_prefix} admin examxlsx <考试ID> - 获取考试成绩单\n"
-                                        f"{chat_prefix} admin examanswersheet <id|name> <学生ID> <考试ID> - 获取考试答题卡\n")
+                                        f"{chat_prefix} admin examcsv <考试ID> - 获取 CSV 格式的考试成绩单\n"
+                                        f"{chat_prefix} admin examanswersheet <id|name> <学生ID> <考试ID> - 获取考试答题卡\n"
+                                        f"{chat_prefix} admin refresh <考试ID> - 重新抓取考试成绩\n"
+                                        f"{chat_prefix} admin jobs - 查看任务队列\n"
+                                        f"{chat_prefix} admin cancel <任务编号> - 取消任务\n"
+                                        f"{chat_prefix} admin stats - 查看消息发送耗时统计\n"
+                                        f"{chat_prefix} admin teachers - 查看教师账号状态\n"
+                                        f"{chat_prefix} admin startup - 查看启动耗时\n")
     if int(sender_id) in super_users:
         send_private_message(sender_id, f"欢迎您，高级用户 {sender_id}：\n"
-                                        f"{chat_prefix} sudo examxlsx <考试ID> - 获取考试成绩单\n")
+                                        f"{chat_prefix} sudo examxlsx <考试ID> - 获取考试成绩单\n"
+                                        f"{chat_prefix} sudo examcsv <考试ID> - 获取 CSV 格式的考试成绩单\n")
 
 
 def handle_login_request(sender_id, message):
@@ -206,20 +328,31 @@ def handle_exam_request(sender_id, message):
             raise CommandError("获取考试列表失败。")
     elif message.startswith("score"):
         examid = message.split(" ", 2)[1]
-        details = zhixue.get_rank_by_stu_code(sender_id, examid)
-        if details:
-            send_private_message(sender_id, details)
-        else:
-            raise CommandError("获取考试成绩失败。")
+        if zhixue.is_exam_fresh(examid):
+            send_exam_score(sender_id, examid)
+        else:  # 未缓存或已过期时需要检查或抓取成绩
+            submit_job(sender_id, f"exam score {examid}", send_exam_score, sender_id, examid)
     elif message.startswith("answersheet"):
         examid = message.split(" ", 2)[1]
-        file_paths = zhixue.get_answersheet_by_qqid(sender_id, examid)
-        for file_path in file_paths:
-            send_private_img(sender_id, f"file://{os.path.abspath(file_path)}")
+        submit_job(sender_id, f"exam answersheet {examid}",
+                   lambda: send_images(sender_id, zhixue.get_answersheet_by_qqid(sender_id, examid)))
     else:
         raise CommandError("未知指令，请使用 /zx help 查看帮助。")
 
 
+def send_exam_score(sender_id, examid):
+    details = zhixue.get_rank_by_stu_code(sender_id, examid)
+    if details:
+        send_private_message(sender_id, details)
+    else:
+        raise CommandError("获取考试成绩失败。")
+
+
+def send_refresh_result(sender_id, examid):
+    students_scores_list = zhixue.force_refresh_exam(sender_id, examid)
+    send_private_message(sender_id, f"已重新抓取考试成绩：{examid}，共 {len(students_scores_list)} 名学生。")
+
+
 def handle_admin_request(sender_id, message):
     if int(sender_id) not in admins:
         logger.info(f"{sender_id} tried to use admin command: {message}")
@@ -242,11 +375,11 @@ def handle_admin_request(sender_id, message):
         action, qqid = message.split(" ", 2)
         if action == "add":
             ban_list.append(int(qqid))
-            save_ban_list(ban_list)
+            state_store.add_ban(qqid)
             send_private_message(sender_id, f"已禁用用户：{qqid}")
         elif action == "rm":
             ban_list.remove(int(qqid))
-            save_ban_list(ban_list)
+            state_store.remove_ban(qqid)
             send_private_message(sender_id, f"已解禁用户：{qqid}")
     elif message.startswith("forcelogout"):
         qqid = message.split(" ", 2)[1]
@@ -257,22 +390,40 @@ def handle_admin_request(sender_id, message):
             raise CommandError("登出失败，疑似未登录智学网账号。")
     elif message.startswith("examxlsx"):
         examid = message.split(" ", 2)[1]
-        file_path = zhixue.get_exam_rank(sender_id, examid)
-        if file_path:
-            send_private_file(sender_id, f"file://{os.path.abspath(file_path)}")
-        else:
-            raise CommandError("获取考试排名失败。")
+        submit_job(sender_id, f"examxlsx {examid}", handle_exam_export, sender_id, examid, "xlsx")
+    elif message.startswith("examcsv"):
+        examid = message.split(" ", 2)[1]
+        submit_job(sender_id, f"examcsv {examid}", handle_exam_export, sender_id, examid, "csv")
+    elif message.startswith("jobs"):
+        send_private_message(sender_id, job_queue.report())
+    elif message.startswith("cancel"):
+        job_id = message.split(" ", 2)[1].lstrip("#")
+        job = job_queue.cancel(int(job_id))
+        if job is None:
+            raise CommandError(f"任务不存在或已结束：#{job_id}")
+        send_private_message(sender_id, f"已取消任务：#{job_id}")
+        if job.owner != sender_id:
+            send_private_message(job.owner, f"任务 #{job_id} {job.name} 已被管理员取消。")
+    elif message.startswith("cache"):
+        send_private_message(sender_id, cache_manager.report())
+    elif message.startswith("refresh"):
+        examid = message.split(" ", 2)[1]
+        submit_job(sender_id, f"refresh {examid}", send_refresh_result, sender_id, examid)
+    elif message.startswith("stats"):
+        send_private_message(sender_id, get_send_stats() + "\n" + get_write_stats() + "\n" + flights.report())
+    elif message.startswith("teachers"):
+        send_private_message(sender_id, zhixue.get_teacher_status())
+    elif message.startswith("startup"):
+        send_private_message(sender_id, get_startup_report())
     elif message.startswith("examanswersheet"):
         message = message[len("examanswersheet") + 1:].strip()
         method, stuid, examid = message.split(" ", 3)
         if method == "id":
-            file_paths = zhixue.get_answersheet_by_stuid(sender_id, stuid, examid)
-            for file_path in file_paths:
-                send_private_img(sender_id, f"file://{os.path.abspath(file_path)}")
+            submit_job(sender_id, f"examanswersheet {stuid} {examid}",
+                       lambda: send_images(sender_id, zhixue.get_answersheet_by_stuid(sender_id, stuid, examid)))
         elif method == "name":
-            file_paths = zhixue.get_answersheet_by_stuname(stuid, sender_id, examid)
-            for file_path in file_paths:
-                send_private_img(sender_id, f"file://{os.path.abspath(file_path)}")
+            submit_job(sender_id, f"examanswersheet {stuid} {examid}",
+                       lambda: send_images(sender_id, zhixue.get_answersheet_by_stuname(stuid, sender_id, examid)))
 
 
 def handle_sudo_request(sender_id, message):
@@ -280,11 +431,18 @@ def handle_sudo_request(sender_id, message):
         raise CommandError("您无权使用该指令。")
     if message.startswith("examxlsx"):
         examid = message.split(" ", 2)[1]
-        file_path = zhixue.get_exam_rank(sender_id, examid)
-        if file_path:
-            send_private_file(sender_id, f"file://{os.path.abspath(file_path)}")
-        else:
-            raise CommandError("获取考试排名失败。")
+        submit_job(sender_id, f"examxlsx {examid}", handle_exam_export, sender_id, examid, "xlsx")
+    elif message.startswith("examcsv"):
+        examid = message.split(" ", 2)[1]
+        submit_job(sender_id, f"examcsv {examid}", handle_exam_export, sender_id, examid, "csv")
+
+
+def handle_exam_export(sender_id, examid, file_format):
+    file_path = zhixue.get_exam_rank(sender_id, examid, file_format)
+    if file_path:
+        send_private_file(sender_id, f"file://{os.path.abspath(file_path)}")
+    else:
+        raise CommandError("获取考试排名失败。")
 
 
 def handle_friend_request(request_data):
@@ -326,14 +484,8 @@ def handle_message(request_data):
             if handler:
                 try:
                     handler(sender_id, message)
-                except CommandError as e:
-                    send_private_message(sender_id, str(e))
                 except Exception as e:
-                    if int(sender_id) in admins:
-                        send_private_message(sender_id, f"发生错误: {str(e)[:100]}")
-                    else:
-                        send_private_message(sender_id, "发生未知错误，请联系管理员。")
-                    logger.exception(f"An error occurred when handling {message}")
+                    report_error(sender_id, message, e)
             else:
                 send_private_message(sender_id, f"未知指令，请使用 {chat_prefix} help 查看帮助。")
         # else:
@@ -341,6 +493,16 @@ def handle_message(request_data):
 
 
 if __name__ == "__main__":
+    log_startup_report()
     zhixue.load_all_stu_list()
-    ban_list = load_ban_list()
-    app.run(host="127.0.0.1", port=5010, threaded=False)
+    ban_list = state_store.load_bans()
+    start_dispatcher()
+    start_write_behind()
+    job_queue.start()
+    zhixue.init_teacher_accounts()
+    zhixue.start_teacher_keepalive()
+    zhixue.start_exam_prefetch()
+    threading.Thread(target=event_worker, name="event-worker", daemon=True).start()
+    if onebot_config.ws_url:
+        start_forward_ws()
+    app.run(host="127.0.0.1", port=5010, threaded=True)
@@ -0,0 +1,182 @@
+import os
+import threading
+import time
+from collections import defaultdict
+
+from loguru import logger
+
+from config_loader import cache_config
+
+CACHE_DIR = "./.zx/cache"
+MB = 1024 * 1024
+EVICT_RATIO = 0.9  # 超出限制时删除至限制的 90%，避免频繁清理
+
+
+class CacheManager:
+    """
+    .zx/cache 文件缓存管理
+    按类型（答题卡、成绩单、原卷图片）分别限制占用空间，总占用不超过 max_bytes。
+    记录文件的最近访问时间，超出限制时删除最久未访问的文件，并统计各类型的命中率。
+    """
+
+    def __init__(self, root: str, max_bytes: int, quotas: dict):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.quotas = quotas
+        self.lock = threading.RLock()
+        self.entries = {}  # 路径 -> [类型, 大小, 最近访问时间]
+        self.usage = defaultdict(int)
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self.evictions = defaultdict(int)
+        self.scanned = False
+
+    @staticmethod
+    def get_kind(path: str) -> str:
+        """根据路径判断缓存类型"""
+        name = os.path.basename(path)
+        if os.path.basename(os.path.dirname(path)) == "sheets":
+            return "sheets"
+        if name.startswith("answersheet_"):
+            return "answersheet"
+        if name.startswith("scores_"):
+            return "exports"
+        return "other"
+
+    def scan(self):
+        """首次使用时扫描缓存目录，以修改时间作为最近访问时间"""
+        with self.lock:
+            if self.scanned:
+                return
+            self.scanned = True
+            for dir_path, _, files in os.walk(self.root):
+                for file in files:
+                    if file.endswith(".tmp"):
+                        continue
+                    path = os.path.normpath(os.path.join(dir_path, file))
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    self.register(path, stat.st_size, stat.st_mtime)
+            logger.info(f"Cache usage: {self.total_bytes() / MB:.1f}MB in {len(self.entries)} files")
+            for kind in list(self.usage):
+                self.evict(kind)
+
+    def register(self, path, size, access_time):
+        kind = self.get_kind(path)
+        old_entry = self.entries.get(path)
+        if old_entry is not None:
+            self.usage[old_entry[0]] -= old_entry[1]
+        self.entries[path] = [kind, size, access_time]
+        self.usage[kind] += size
+        return kind
+
+    def total_bytes(self) -> int:
+        return sum(self.usage.values())
+
+    def lookup(self, path: str) -> bool:
+        """
+        查询缓存文件是否存在，存在时更新最近访问时间
+        Return:
+            bool: 是否命中
+        """
+        self.scan()
+        path = os.path.normpath(path)
+        kind = self.get_kind(path)
+        exists = os.path.exists(path)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(path)
+            if exists:
+                self.hits[kind] += 1
+                if entry is None:
+                    self.register(path, os.path.getsize(path), now)
+                else:
+                    entry[2] = now
+            else:
+                self.misses[kind] += 1
+                if entry is not None:
+                    self.usage[entry[0]] -= entry[1]
+                    del self.entries[path]
+        if exists:
+            try:
+                os.utime(path)  # 重启后扫描时按修改时间恢复访问顺序
+            except OSError:
+                pass
+        return exists
+
+    def add(self, path: str):
+        """登记新写入的缓存文件，超出限制时删除最久未访问的文件"""
+        self.scan()
+        path = os.path.normpath(path)
+        try:
+            size = os.path.getsize(path)
+        except OSError as e:
+            logger.warning(f"Failed to add cache file {path}: {e}")
+            return
+        with self.lock:
+            kind = self.register(path, size, time.time())
+            self.evict(kind)
+
+    def remove(self, path: str):
+        """删除缓存文件"""
+        path = os.path.normpath(path)
+        with self.lock:
+            entry = self.entries.pop(path, None)
+            if entry is not None:
+                self.usage[entry[0]] -= entry[1]
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def evict(self, kind: str):
+        with self.lock:
+            quota = self.quotas.get(kind)
+            if quota is not None and self.usage[kind] > quota:
+                self.evict_until(lambda: self.usage[kind] <= quota * EVICT_RATIO, kind)
+            if self.total_bytes() > self.max_bytes:
+                self.evict_until(lambda: self.total_bytes() <= self.max_bytes * EVICT_RATIO)
+
+    def evict_until(self, done: callable, kind=None):
+        candidates = sorted((entry[2], path) for path, entry in self.entries.items()
+                            if kind is None or entry[0] == kind)
+        for _, path in candidates:
+            if done():
+                break
+            entry = self.entries.pop(path)
+            self.usage[entry[0]] -= entry[1]
+            self.evictions[entry[0]] += 1
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Failed to evict cache file {path}: {e}")
+        logger.info(f"Evicted cache files, usage: {self.total_bytes() / MB:.1f}MB")
+
+    def clear(self):
+        """清空缓存记录（文件由调用方删除）"""
+        with self.lock:
+            self.entries.clear()
+            self.usage.clear()
+
+    def report(self) -> str:
+        """获得各类型缓存的占用空间及命中率"""
+        self.scan()
+        with self.lock:
+            lines = [f"总计: {self.total_bytes() / MB:.1f}/{self.max_bytes / MB:.0f}MB，{len(self.entries)} 个文件"]
+            for kind in sorted(set(self.usage) | set(self.hits) | set(self.misses)):
+                quota = self.quotas.get(kind)
+                limit = f"/{quota / MB:.0f}" if quota is not None else ""
+                requests = self.hits[kind] + self.misses[kind]
+                hit_rate = f"{self.hits[kind] / requests * 100:.0f}%" if requests else "-"
+                lines.append(f"{kind}: {self.usage[kind] / MB:.1f}{limit}MB，命中率 {hit_rate} "
+                             f"({self.hits[kind]}/{requests})，淘汰 {self.evictions[kind]} 个")
+            return "\n".join(lines)
+
+
+cache_manager = CacheManager(CACHE_DIR, cache_config.max_size * MB, {
+    "answersheet": cache_config.answersheet_quota * MB,
+    "exports": cache_config.exports_quota * MB,
+    "sheets": cache_config.sheets_quota * MB,
+})
@@ -11,9 +11,14 @@ class ConfigError(Exception):
 
 
 class OnebotConfig:
-    def __init__(self, http_url: str, access_token: str):
+    def __init__(self, http_url: str, access_token: str, timeout=10, max_retries=2, ws_url="",
+                 reverse_ws_path=""):
         self.http_url = http_url
+        self.ws_url = ws_url
+        self.reverse_ws_path = reverse_ws_path
         self.access_token = access_token
+        self.timeout = timeout
+        self.max_retries = max_retries
 
 
 class MessageConfig:
@@ -27,17 +32,50 @@ class MessageConfig:
 
 class ZhixueConfig:
     def __init__(self, teacher_accounts: list[str], teacher_passwords: list[str], teacher_login_method: list[str],
-                 captcha_api: str):
+                 captcha_api: str, crawl_concurrency=4, crawl_interval=0.2, answersheet_workers=3,
+                 login_check_ttl=300, keepalive_interval=600, exam_refresh_ttl=600, exam_finished_ttl=86400,
+                 exam_finished_days=3, save_interval=5, prefetch_interval=1800, prefetch_hours=(0, 24),
+                 prefetch_latest=3, prefetch_concurrency=1):
         self.teacher_accounts = teacher_accounts
         self.teacher_passwords = teacher_passwords
         self.teacher_login_method = teacher_login_method
         self.captcha_api = captcha_api
+        self.crawl_concurrency = crawl_concurrency
+        self.crawl_interval = crawl_interval
+        self.answersheet_workers = answersheet_workers
+        self.login_check_ttl = login_check_ttl
+        self.keepalive_interval = keepalive_interval
+        self.exam_refresh_ttl = exam_refresh_ttl
+        self.exam_finished_ttl = exam_finished_ttl
+        self.exam_finished_days = exam_finished_days
+        self.save_interval = save_interval
+        self.prefetch_interval = prefetch_interval
+        self.prefetch_hours = prefetch_hours
+        self.prefetch_latest = prefetch_latest
+        self.prefetch_concurrency = prefetch_concurrency
+
+class CacheConfig:
+    def __init__(self, max_size=1024, answersheet_quota=512, exports_quota=128, sheets_quota=256):
+        self.max_size = max_size
+        self.answersheet_quota = answersheet_quota
+        self.exports_quota = exports_quota
+        self.sheets_quota = sheets_quota
+
+
+class JobsConfig:
+    def __init__(self, workers=2, timeout=600):
+        self.workers = workers
+        self.timeout = timeout
+
 
 class AssetsConfig:
     def __init__(self, font_path: str):
         self.font_path = font_path
-        if not os.path.exists(font_path) or not os.path.isfile(font_path):
-            raise ConfigError(f"No such file: {font_path}")
+
+    def check_font_path(self):
+        """字体文件仅在绘制答题卡时使用，首次使用时再检查"""
+        if not os.path.exists(self.font_path) or not os.path.isfile(self.font_path):
+            raise ConfigError(f"No such file: {self.font_path}")
 
 
 with open(config_path, "r", encoding="utf-8") as file:
@@ -48,6 +86,8 @@ try:
     message_config = MessageConfig(**config_data.get("message", {}))
     zhixue_config = ZhixueConfig(**config_data.get("zhixue", {}))
     assets_config = AssetsConfig(**config_data.get("assets", {}))
+    cache_config = CacheConfig(**config_data.get("cache", {}))
+    jobs_config = JobsConfig(**config_data.get("jobs", {}))
     logger.success("Successfully loaded config")
 except Exception as e:
     logger.critical(f"FATAL ERROR: Failed to load config: {e}")
@@ -0,0 +1,118 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from loguru import logger
+
+from config_loader import zhixue_config
+from jobs import current_job
+from models import ZhixueError
+
+MAX_INTERVAL = 5  # 触发风控后请求间隔的上限（秒）
+MAX_RETRIES = 3
+
+
+class PageCrawler:
+    """
+    分页并发抓取
+    同时进行的请求数不超过 concurrency，相邻两次请求至少间隔 interval 秒。
+    遇到 HTML 或错误响应时加大请求间隔并重试，请求成功后逐渐恢复。
+    """
+
+    def __init__(self, name: str, concurrency=None, interval=None, max_retries=MAX_RETRIES):
+        self.name = name
+        self.concurrency = max(1, concurrency or zhixue_config.crawl_concurrency)
+        self.base_interval = zhixue_config.crawl_interval if interval is None else interval
+        self.interval = self.base_interval
+        self.max_retries = max_retries
+        self.lock = threading.Lock()
+        self.next_request_time = 0
+        self.page_times = {}
+        self.retries = 0
+        self.aborted = threading.Event()  # 某页最终失败或任务取消后，不再发起新的请求
+        self.job = None
+
+    def wait_turn(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_request_time)
+            self.next_request_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+    def slow_down(self):
+        with self.lock:
+            self.interval = min(max(self.interval * 2, 0.5), MAX_INTERVAL)
+            self.retries += 1
+            return self.interval
+
+    def speed_up(self):
+        with self.lock:
+            self.interval = max(self.base_interval, self.interval * 0.8)
+
+    def check_aborted(self):
+        if self.job is not None:
+            self.job.check()
+        if self.aborted.is_set():
+            raise ZhixueError("Crawl aborted")
+
+    def fetch(self, page, fetch_page):
+        for attempt in range(self.max_retries + 1):
+            self.wait_turn()
+            self.check_aborted()
+            start = time.perf_counter()
+            try:
+                data = fetch_page(page)
+            except Exception as e:
+                interval = self.slow_down()
+                logger.warning(f"[{self.name}] Failed to fetch page {page} (attempt {attempt + 1}): {e}, "
+                               f"interval -> {interval:.2f}s")
+                continue
+            elapsed = time.perf_counter() - start
+            self.page_times[page] = elapsed
+            self.speed_up()
+            logger.debug(f"[{self.name}] Fetched page {page} in {elapsed:.2f}s")
+            return data
+        raise ZhixueError(f"Failed to fetch page {page} after {self.max_retries + 1} attempts")
+
+    def crawl(self, pages, fetch_page, on_page=None) -> list:
+        """
+        并发抓取全部页面
+        Args:
+            pages: 页码列表
+            fetch_page: 抓取单页的函数，返回该页数据，失败时抛出异常
+            on_page: 每页完成后的回调，参数为 (页码, 数据)
+        Return:
+            list: 按页码顺序排列的各页数据
+        """
+        start = time.perf_counter()
+        results = {}
+        self.job = current_job.get()  # 抓取线程中无法读取任务上下文，在此记录以便检查是否已取消
+        pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix=f"crawl-{self.name}")
+        try:
+            futures = {pool.submit(self.fetch, page, fetch_page): page for page in pages}
+            for future in as_completed(futures):
+                page = futures[future]
+                results[page] = future.result()
+                if on_page:
+                    on_page(page, results[page])
+        except BaseException:
+            # 出错或任务取消时不再抓取剩余页面
+            self.aborted.set()
+            pool.shutdown(cancel_futures=True)
+            raise
+        pool.shutdown()
+        logger.info(f"[{self.name}] {self.report(time.perf_counter() - start)}")
+        return [results[page] for page in pages]
+
+    def report(self, total_time=None) -> str:
+        """抓取耗时统计"""
+        if not self.page_times:
+            return "No page fetched"
+        times = list(self.page_times.values())
+        report = (f"Fetched {len(times)} pages, avg {sum(times) / len(times):.2f}s/page, "
+                  f"max {max(times):.2f}s, retries {self.retries}, "
+                  f"concurrency {self.concurrency}, final interval {self.interval:.2f}s")
+        if total_time is not None:
+            report += f", total {total_time:.2f}s"
+        return report
@@ -1,20 +1,39 @@
 import os
 import pickle
+import re
+import shutil
+import threading
+from collections import OrderedDict
 
 from loguru import logger
 
+from cache_manager import cache_manager
+from store import state_store
+
+EXAM_SCORES_DIR = "./.zx/data/exam_scores"
+EXAM_SCORES_LRU_SIZE = 8  # 内存中保留的热门考试数量
+STATE_TABLES = {"stu_list": "students", "tch_list": "teachers", "exam_meta": "exam_meta"}  # 清除数据时的名称 -> 表
+
 if not os.path.exists("./.zx/data"):
     os.makedirs("./.zx/data")
+if not os.path.exists(EXAM_SCORES_DIR):
+    os.makedirs(EXAM_SCORES_DIR)
 if not os.path.exists("./.zx/config"):
     os.makedirs("./.zx/config")
 if not os.path.exists("./.zx/cache"):
     os.makedirs("./.zx/cache")
 
 
-def save_cache(file: str, data):
-    with open(f"./.zx/data/{file}.pkl", "wb") as f:
+def atomic_dump(path: str, data):
+    """先写入临时文件再重命名，写入过程中断时不会损坏原文件"""
+    with open(f"{path}.tmp", "wb") as f:
         pickle.dump(data, f)
-        logger.success(f"Successfully saved cache: {file}")
+    os.replace(f"{path}.tmp", path)
+
+
+def save_cache(file: str, data):
+    atomic_dump(f"./.zx/data/{file}.pkl", data)
+    logger.success(f"Successfully saved cache: {file}")
 
 
 def load_cache(file: str, typ="dict"):
@@ -29,34 +48,127 @@ def load_cache(file: str, typ="dict"):
         return []
 
 
-def save_ban_list(ban_list):
-    with open("./.zx/config/ban_list.pkl", "wb") as f:
-        pickle.dump(ban_list, f)
-        logger.success("Successfully saved ban_list")
+exam_scores_lru = OrderedDict()
+exam_scores_lock = threading.Lock()
+
 
+def get_exam_scores_path(exam_id: str):
+    if not re.fullmatch(r"[\w-]+", str(exam_id)):
+        raise ValueError(f"Invalid exam id: {exam_id}")
+    return f"{EXAM_SCORES_DIR}/{exam_id}.pkl"
 
-def load_ban_list():
+
+def save_exam_scores(exam_id: str, data):
+    """
+    保存单场考试成绩，每场考试单独存储为一个文件
+    Args:
+        exam_id: 考试 ID
+        data: 成绩数据
+    """
+    path = get_exam_scores_path(exam_id)
+    with exam_scores_lock:
+        atomic_dump(path, data)
+        exam_scores_lru[exam_id] = data
+        exam_scores_lru.move_to_end(exam_id)
+        while len(exam_scores_lru) > EXAM_SCORES_LRU_SIZE:
+            exam_scores_lru.popitem(last=False)
+    logger.success(f"Successfully saved exam scores: {exam_id}")
+
+
+def load_exam_scores(exam_id: str):
+    """
+    读取单场考试成绩，优先从内存中读取
+    Args:
+        exam_id: 考试 ID
+    Return:
+        成绩数据，不存在时返回 None
+    """
     try:
-        with open("./.zx/config/ban_list.pkl", "rb") as f:
-            logger.success("Successfully loaded ban_list")
-            return pickle.load(f)
+        path = get_exam_scores_path(exam_id)
+    except ValueError as e:
+        logger.warning(str(e))
+        return None
+    with exam_scores_lock:
+        if exam_id in exam_scores_lru:
+            exam_scores_lru.move_to_end(exam_id)
+            return exam_scores_lru[exam_id]
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                data = pickle.load(f)
+        except Exception as e:
+            logger.error(f"Failed to load exam scores {exam_id}: {e}")
+            return None
+        exam_scores_lru[exam_id] = data
+        while len(exam_scores_lru) > EXAM_SCORES_LRU_SIZE:
+            exam_scores_lru.popitem(last=False)
+    logger.success(f"Successfully loaded exam scores: {exam_id}")
+    return data
+
+
+def get_exam_scores_version(exam_id: str):
+    """
+    获得单场考试成绩的数据版本，成绩重新保存后版本改变
+    Return:
+        int: 数据版本，未保存时返回 0
+    """
+    try:
+        return os.stat(get_exam_scores_path(exam_id)).st_mtime_ns
+    except (OSError, ValueError):
+        return 0
+
+
+def migrate_exam_scores():
+    """将旧版整体存储的 exam_scores.pkl 拆分为按考试存储的文件"""
+    legacy_path = "./.zx/data/exam_scores.pkl"
+    if not os.path.exists(legacy_path):
+        return
+    try:
+        with open(legacy_path, "rb") as f:
+            legacy_scores = pickle.load(f)
+        for exam_id, data in legacy_scores.items():
+            atomic_dump(get_exam_scores_path(exam_id), data)
+        os.remove(legacy_path)
+        logger.success(f"Successfully migrated {len(legacy_scores)} exams from exam_scores.pkl")
     except Exception as e:
-        logger.error(f"Failed to load ban_list: {e}")
-        return []
+        logger.error(f"Failed to migrate exam_scores.pkl: {e}")
+
+
+def clear_exam_scores():
+    with exam_scores_lock:
+        exam_scores_lru.clear()
+        shutil.rmtree(EXAM_SCORES_DIR, ignore_errors=True)
+        os.makedirs(EXAM_SCORES_DIR, exist_ok=True)
 
 
 def clean_cache_data(file: str):
     if file == "all":
         try:
             for file in os.listdir("./.zx/data"):
-                os.remove(f"./.zx/data/{file}")
+                if os.path.isfile(f"./.zx/data/{file}") and not file.startswith("state.db"):
+                    os.remove(f"./.zx/data/{file}")
+            for table in STATE_TABLES.values():
+                state_store.clear(table)
+            clear_exam_scores()
             logger.success("Successfully cleaned all cache data")
             return True
         except Exception as e:
             logger.error(f"Failed to clean cache data: {e}")
             return False
+    if file == "exam_scores":
+        try:
+            clear_exam_scores()
+            logger.success("Successfully cleaned cache data: exam_scores")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to clean cache data: {e}")
+            return False
     try:
-        os.remove(f"./.zx/data/{file}.pkl")
+        if file in STATE_TABLES:
+            state_store.clear(STATE_TABLES[file])
+        else:
+            os.remove(f"./.zx/data/{file}.pkl")
         logger.success(f"Successfully cleaned cache data: {file}")
         return True
     except Exception as e:
@@ -67,9 +179,14 @@ def clean_cache_data(file: str):
 def clean_cache_file():
     try:
         for file in os.listdir("./.zx/cache"):
-            os.remove(f"./.zx/cache/{file}")
+            if os.path.isdir(f"./.zx/cache/{file}"):
+                shutil.rmtree(f"./.zx/cache/{file}")
+            else:
+                os.remove(f"./.zx/cache/{file}")
+        cache_manager.clear()
         logger.success("Successfully cleaned all cache file")
         return True
     except Exception as e:
         logger.error(f"Failed to clean cache: {e}")
         return False
+
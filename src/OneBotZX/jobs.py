@@ -0,0 +1,185 @@
+import contextvars
+import itertools
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+
+from loguru import logger
+
+from config_loader import jobs_config
+from models import JobCancelled
+from msg import send_private_message
+
+PROGRESS_INTERVAL = 5  # 两条进度消息的最小间隔（秒）
+
+current_job = ContextVar("current_job", default=None)  # 当前线程正在执行的任务
+job_ids = itertools.count(1)
+
+
+class Job:
+    """耗时指令对应的任务"""
+
+    def __init__(self, owner, name: str, func: callable, args: tuple, timeout: float):
+        self.id = next(job_ids)
+        self.owner = owner
+        self.name = name
+        self.func = func
+        self.args = args
+        self.timeout = timeout
+        self.context = contextvars.copy_context()  # 保留提交时的上下文（所属机器人等）
+        self.status = "queued"
+        self.progress = ""
+        self.created_at = time.time()
+        self.started_at = None
+        self.last_progress_at = 0
+        self.cancelled = threading.Event()
+
+    def run(self):
+        current_job.set(self)
+        self.func(*self.args)
+
+    def check(self):
+        """任务已取消或超时时抛出 JobCancelled"""
+        if self.cancelled.is_set():
+            raise JobCancelled(f"Job {self.id} cancelled")
+
+    def describe(self) -> str:
+        if self.started_at is not None:
+            elapsed = f"，已运行 {time.time() - self.started_at:.0f}s"
+        else:
+            elapsed = f"，已等待 {time.time() - self.created_at:.0f}s"
+        progress = f"，{self.progress}" if self.progress else ""
+        return f"#{self.id} {self.name} ({self.owner})：{self.status}{elapsed}{progress}"
+
+
+class JobQueue:
+    """
+    任务队列
+    耗时指令提交后立即返回排队位置，由 workers 个工作线程依次执行。
+    每个任务在独立线程中运行，超过 timeout 秒后标记为超时并通知用户。
+    线程无法强制结束，超时的任务在下一次检查取消状态时退出，退出前仍占用工作线程，同时运行的任务不超过 workers 个。
+    """
+
+    def __init__(self, workers: int, timeout: float):
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.condition = threading.Condition()
+        self.queue = deque()
+        self.running = {}  # 任务 ID -> Job
+
+    def submit(self, owner, name: str, func: callable, *args) -> tuple:
+        """
+        提交任务
+        Return:
+            Job: 任务
+            int: 前面等待的任务数，有空闲工作线程时为 0
+        """
+        job = Job(owner, name, func, args, self.timeout)
+        with self.condition:
+            idle = self.workers - len(self.running)
+            position = max(0, len(self.queue) - idle + 1)
+            self.queue.append(job)
+            self.condition.notify()
+        logger.info(f"Queued job #{job.id} {name} for {owner}, position {position}")
+        return job, position
+
+    def worker(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                job = self.queue.popleft()
+                job.status = "running"
+                job.started_at = time.time()
+                self.running[job.id] = job
+            try:
+                self.execute(job)
+            finally:
+                with self.condition:
+                    self.running.pop(job.id, None)
+
+    def execute(self, job: Job):
+        result = {}
+
+        def target():
+            try:
+                job.context.run(job.run)
+                result["ok"] = True
+            except JobCancelled:
+                if not job.cancelled.is_set():  # 共享的抓取（single-flight）被其他任务取消
+                    job.context.copy().run(send_private_message, job.owner, f"任务 #{job.id} {job.name} 被中断，请重试。")
+            except Exception:
+                logger.exception(f"Job #{job.id} {job.name} failed")
+
+        thread = threading.Thread(target=target, name=f"job-{job.id}", daemon=True)
+        thread.start()
+        thread.join(job.timeout)
+        if thread.is_alive():
+            # 线程无法强制结束，标记取消后由任务在下一次汇报进度时退出
+            job.cancelled.set()
+            job.status = "timeout"
+            logger.warning(f"Job #{job.id} {job.name} timed out after {job.timeout}s")
+            job.context.copy().run(send_private_message, job.owner, f"任务 #{job.id} {job.name} 超时，请稍后重试。")
+            thread.join()
+        elif job.cancelled.is_set():
+            job.status = "cancelled"
+        else:
+            job.status = "done" if result.get("ok") else "failed"
+        logger.info(f"Job #{job.id} {job.name} {job.status} in {time.time() - job.started_at:.1f}s")
+
+    def cancel(self, job_id: int):
+        """
+        取消等待中或运行中的任务，运行中的任务在下一次汇报进度时退出
+        Return:
+            Job: 被取消的任务，不存在时返回 None
+        """
+        with self.condition:
+            for job in self.queue:
+                if job.id == job_id:
+                    self.queue.remove(job)
+                    job.status = "cancelled"
+                    job.cancelled.set()
+                    return job
+            job = self.running.get(job_id)
+        if job is not None:
+            job.cancelled.set()
+        return job
+
+    def report(self) -> str:
+        with self.condition:
+            jobs = list(self.running.values()) + list(self.queue)
+        if not jobs:
+            return "当前没有任务。"
+        return "\n".join(job.describe() for job in jobs)
+
+    def start(self):
+        for i in range(self.workers):
+            threading.Thread(target=self.worker, name=f"job-worker-{i}", daemon=True).start()
+        logger.info(f"Started {self.workers} job workers, timeout {self.timeout}s")
+
+
+def report_progress(message: str, force=False):
+    """
+    汇报当前任务的进度，至多每 PROGRESS_INTERVAL 秒向用户发送一次
+    不在任务中调用时不做任何事；任务已取消或超时时抛出 JobCancelled
+    """
+    job = current_job.get()
+    if job is None:
+        return
+    job.check()
+    job.progress = message
+    now = time.time()
+    if force or now - job.last_progress_at >= PROGRESS_INTERVAL:
+        job.last_progress_at = now
+        send_private_message(job.owner, f"任务 #{job.id} {job.name}：{message}")
+
+
+def check_cancelled():
+    """当前任务已取消或超时时抛出 JobCancelled"""
+    job = current_job.get()
+    if job is not None:
+        job.check()
+
+
+job_queue = JobQueue(jobs_config.workers, jobs_config.timeout)
@@ -1,5 +1,8 @@
 import base64
 import json
+import threading
+import time
+from collections import defaultdict
 
 import requests
 from loguru import logger
@@ -12,16 +15,23 @@ from zhixuewang.teacher import TeacherAccount
 from zhixuewang.urls import Url
 
 import config_loader as config
-from models import LoginCaptchaError
+from models import LoginCaptchaError, ZhixueError
 from msg import send_private_message
 
 teacher_accounts = config.zhixue_config.teacher_accounts
 teacher_login_method = config.zhixue_config.teacher_login_method
 captcha_api = config.zhixue_config.captcha_api
 top_admin_id = config.message_config.admins[0]
+login_check_ttl = config.zhixue_config.login_check_ttl
 
 MAX_RETRIES = 5
 
+login_checked_at = {}  # 用户名 -> 上次确认登录状态有效的时间
+refreshing_accounts = set()
+refresh_lock = threading.Lock()
+relogin_locks = defaultdict(threading.Lock)
+relogin_listeners = []
+
 
 def gen_encrypted_password(password):
     if len(password) != 32:
@@ -265,13 +275,86 @@ def login_by_captcha(username: str, password: str) -> Account:
     return TeacherAccount(session).set_base_info().set_advanced_info()
 
 
-def update_login_status_self(account: Account):
-    """更新登录状态. 如果 session 过期自动重新获取"""
-    r = account._session.get(Url.GET_LOGIN_STATE)
+def add_relogin_listener(listener: callable):
+    """注册重新登录后的回调，参数为重新登录的账号"""
+    relogin_listeners.append(listener)
+
+
+def relogin(account: Account):
+    """使用 session 中保存的密码重新登录，同一账号同时只进行一次"""
+    requested_at = time.time()
+    with relogin_locks[account.username]:
+        if login_checked_at.get(account.username, 0) > requested_at:
+            return account  # 等待期间已由其他线程重新登录
+        password = base64.b64decode(account._session.cookies["pwd"].encode()).decode()
+        account._session = get_session_by_captcha(account.username, password)
+        if hasattr(account, "_token"):
+            account._token = None  # token 与 session 绑定，需重新获取
+        login_checked_at[account.username] = time.time()
+    logger.info(f"Successfully re-logged in: {account.username}")
+    for listener in relogin_listeners:
+        try:
+            listener(account)
+        except Exception as e:
+            logger.error(f"Failed to run relogin listener: {e}")
+    return account
+
+
+def check_login_status(account: Account) -> bool:
+    """
+    检查登录状态. 如果 session 过期自动重新获取
+    Return:
+        bool: 是否重新登录
+    """
+    r = account._session.get(Url.GET_LOGIN_STATE, timeout=10)
     data = r.json()
     if data["result"] == "success":
-        return account
+        login_checked_at[account.username] = time.time()
+        return False
     # session过期
-    password = base64.b64decode(account._session.cookies["pwd"].encode()).decode()
-    account._session = get_session_by_captcha(account.username, password)
+    relogin(account)
+    return True
+
+
+def refresh_login_status(account: Account):
+    with refresh_lock:
+        if account.username in refreshing_accounts:
+            return
+        refreshing_accounts.add(account.username)
+
+    def run():
+        try:
+            check_login_status(account)
+        except Exception as e:
+            logger.warning(f"Failed to refresh login status of {account.username}: {e}")
+        finally:
+            with refresh_lock:
+                refreshing_accounts.discard(account.username)
+
+    threading.Thread(target=run, name=f"refresh-{account.username}", daemon=True).start()
+
+
+def update_login_status_self(account: Account):
+    """
+    更新登录状态. 如果 session 过期自动重新获取
+    在 login_check_ttl 内确认过有效的 session 直接使用，超过有效期后在后台重新检查
+    """
+    checked_at = login_checked_at.get(account.username)
+    if checked_at is None:
+        check_login_status(account)
+    elif time.time() - checked_at > login_check_ttl:
+        refresh_login_status(account)
     return account
+
+
+def call_with_relogin(account: Account, func: callable, *args, **kwargs):
+    """
+    调用接口，失败时检查登录状态，若 session 已失效则重新登录并重试一次
+    """
+    try:
+        return func(*args, **kwargs)
+    except (ZhixueError, ValueError, KeyError) as e:
+        logger.warning(f"Request failed for {account.username}, checking login status: {e}")
+        if not check_login_status(account):
+            raise
+    return func(*args, **kwargs)
@@ -11,4 +11,12 @@ class FailedGetTeacherAccountError(Exception):
 
 
 class CommandError(Exception):
-    pass
\ No newline at end of file
+    pass
+
+
+class OnebotError(Exception):
+    pass
+
+
+class JobCancelled(Exception):
+    pass
@@ -1,12 +1,70 @@
-import json
+import threading
+import time
+from collections import defaultdict, deque
+from contextvars import ContextVar
+from queue import Queue
 
 import requests
 from loguru import logger
+from requests.adapters import HTTPAdapter
 
-from config_loader import onebot_config
+from config_loader import onebot_config, message_config
+from models import OnebotError
+from ws_transport import get_reverse_connection
 
 http_url = onebot_config.http_url
 access_token = onebot_config.access_token
+timeout = onebot_config.timeout
+max_retries = onebot_config.max_retries
+reply_limit = message_config.reply_limit
+
+# 重复执行不会产生副作用的动作，请求失败时可以重试
+IDEMPOTENT_ACTIONS = {"set_friend_add_request", "get_login_info", "get_status", "get_version_info"}
+
+session = requests.Session()
+session.headers.update({
+    "Content-Type": "application/json",
+    "Authorization": f"Bearer {access_token}",
+})
+session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=8))
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=8))
+
+outbound_queue = Queue()
+ws_transport = None
+current_self_id = ContextVar("current_self_id", default=None)  # 当前处理事件所属的机器人 QQ 号
+
+
+class LatencyStats:
+    """记录各动作最近的请求耗时"""
+
+    def __init__(self, size=1000):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(lambda: deque(maxlen=size))
+        self.counts = defaultdict(int)
+        self.failures = defaultdict(int)
+
+    def record(self, action, elapsed, ok=True):
+        with self.lock:
+            self.samples[action].append(elapsed)
+            self.counts[action] += 1
+            if not ok:
+                self.failures[action] += 1
+
+    def report(self) -> str:
+        with self.lock:
+            if not self.counts:
+                return "暂无发送记录。"
+            lines = []
+            for action in sorted(self.counts):
+                samples = sorted(self.samples[action])
+                avg = sum(samples) / len(samples)
+                p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+                lines.append(f"{action}: {self.counts[action]} 次 (失败 {self.failures[action]})，"
+                             f"平均 {avg * 1000:.0f}ms，P95 {p95 * 1000:.0f}ms，最大 {samples[-1] * 1000:.0f}ms")
+            return "\n".join(lines)
+
+
+send_stats = LatencyStats()
 
 
 def truncate_string(s, length=30):
@@ -16,61 +74,161 @@ def truncate_string(s, length=30):
         return s
 
 
-def send_request(url, headers, data, content, msg_type = "message"):
-    response = requests.post(url, headers=headers, data=json.dumps(data))
-    if response.status_code == 200:
-        result = response.json()
-        if result["status"] == "ok":
-            if msg_type == "message":
-                logger.success(f"Successfully sent message: {truncate_string(content)}")
-            elif msg_type == "image":
-                logger.success(f"Successfully sent image: {content}")
-            elif msg_type == "file":
-                logger.success(f"Successfully sent file: {content}")
-            elif msg_type == "friend_request":
-                logger.success(f"Successfully approved friend request: {content}")
-            return True
-        else:
-            if msg_type == "message":
-                logger.error(f"Failed to send message, response: {str(result)}")
-            elif msg_type == "image":
-                logger.error(f"Failed to send image, response: {str(result)}")
-            elif msg_type == "file":
-                logger.error(f"Failed to send file, response: {str(result)}")
-            elif msg_type == "friend_request":
-                logger.error(f"Failed to approve friend request, response: {str(result)}")
-            return False
+def bind_self_id(self_id):
+    """设置当前处理事件所属的机器人，之后发送的消息通过该机器人的连接发送"""
+    current_self_id.set(str(self_id) if self_id else None)
+
+
+def get_transport(self_id=None):
+    """
+    按 反向 WebSocket > 正向 WebSocket 的顺序选择可用连接，均不可用时返回 None（使用 HTTP）
+    未指定 self_id 且未配置 HTTP 时使用任意一个反向连接；指定的机器人已断开时不经其他机器人发送
+    """
+    transport = get_reverse_connection(self_id) if self_id else None
+    if transport is None and ws_transport is not None and ws_transport.is_connected():
+        transport = ws_transport
+    if transport is None and not http_url and not self_id:
+        transport = get_reverse_connection()
+    return transport
+
+
+def call_action(action, data, self_id=None) -> dict:
+    """
+    调用 OneBot 动作，优先通过 self_id 对应的 WebSocket 连接发送，否则通过 HTTP 发送
+    Args:
+        action: 动作名称
+        data: 动作参数
+        self_id: 机器人 QQ 号，默认为当前处理事件所属的机器人
+    Return:
+        dict: OneBot 返回结果
+    Raises:
+        OnebotError: 请求失败
+    """
+    self_id = self_id or current_self_id.get()
+    transport = get_transport(self_id)
+    if transport is not None:
+        start = time.perf_counter()
+        try:
+            result = transport.call(action, data, timeout)
+        except OnebotError:
+            send_stats.record(action, time.perf_counter() - start, False)
+            raise
+        send_stats.record(action, time.perf_counter() - start)
+        return result
+    if not http_url:
+        raise OnebotError(f"no available connection for bot {self_id}" if self_id else "no available connection")
+    attempts = max_retries + 1 if action in IDEMPOTENT_ACTIONS else 1
+    for attempt in range(attempts):
+        start = time.perf_counter()
+        try:
+            response = session.post(f"{http_url}/{action}", json=data, timeout=timeout)
+        except requests.RequestException as e:
+            send_stats.record(action, time.perf_counter() - start, False)
+            if attempt == attempts - 1:
+                raise OnebotError(f"request failed: {e}")
+            logger.warning(f"Failed to call {action} (attempt {attempt + 1}): {e}")
+            continue
+        send_stats.record(action, time.perf_counter() - start, response.status_code == 200)
+        if response.status_code >= 500 and attempt < attempts - 1:
+            logger.warning(f"Failed to call {action} (attempt {attempt + 1}), status code: {response.status_code}")
+            continue
+        if response.status_code != 200:
+            raise OnebotError(f"status code: {response.status_code}")
+        return response.json()
+
+
+def set_ws_transport(transport):
+    """设置用于调用动作的 WebSocket 连接"""
+    global ws_transport
+    ws_transport = transport
+
+
+def get_send_stats() -> str:
+    """获得 OneBot 请求耗时统计"""
+    return send_stats.report()
+
+
+def send_request(action, data, content, msg_type = "message", self_id=None):
+    try:
+        result = call_action(action, data, self_id)
+    except OnebotError as e:
+        if msg_type == "message":
+            logger.error(f"Failed to send message, {e}")
+        elif msg_type == "image":
+            logger.error(f"Failed to send image, {e}")
+        elif msg_type == "file":
+            logger.error(f"Failed to send file, {e}")
+        elif msg_type == "friend_request":
+            logger.error(f"Failed to approve friend request, {e}")
+        return False
+    if result["status"] == "ok":
+        if msg_type == "message":
+            logger.success(f"Successfully sent message: {truncate_string(content)}")
+        elif msg_type == "image":
+            logger.success(f"Successfully sent image: {content}")
+        elif msg_type == "file":
+            logger.success(f"Successfully sent file: {content}")
+        elif msg_type == "friend_request":
+            logger.success(f"Successfully approved friend request: {content}")
+        return True
     else:
         if msg_type == "message":
-            logger.error(f"Failed to send message, status code: {str(response.status_code)}")
+            logger.error(f"Failed to send message, response: {str(result)}")
         elif msg_type == "image":
-            logger.error(f"Failed to send image, status code: {str(response.status_code)}")
+            logger.error(f"Failed to send image, response: {str(result)}")
         elif msg_type == "file":
-            logger.error(f"Failed to send file, status code: {str(response.status_code)}")
+            logger.error(f"Failed to send file, response: {str(result)}")
         elif msg_type == "friend_request":
-            logger.error(f"Failed to approve friend request, status code: {str(response.status_code)}")
+            logger.error(f"Failed to approve friend request, response: {str(result)}")
         return False
 
 
+def enqueue_request(action, data, content, msg_type="message"):
+    """
+    将待发送的消息加入发送队列，由发送线程按 reply_limit 间隔依次发送
+    消息将通过当前处理事件所属机器人的连接发送
+    Return:
+        bool: 是否成功加入队列
+    """
+    outbound_queue.put((action, data, content, msg_type, current_self_id.get()))
+    return True
+
+
+def dispatch_worker():
+    """发送线程：依次取出队列中的消息并发送，两次发送之间至少间隔 reply_limit 秒"""
+    last_sent = 0
+    while True:
+        action, data, content, msg_type, self_id = outbound_queue.get()
+        wait_time = reply_limit - (time.time() - last_sent)
+        if wait_time > 0:
+            time.sleep(wait_time)
+        try:
+            send_request(action, data, content, msg_type, self_id)
+        except Exception as e:
+            logger.error(f"Failed to send {msg_type}: {e}")
+        finally:
+            last_sent = time.time()
+            outbound_queue.task_done()
+
+
+def start_dispatcher():
+    thread = threading.Thread(target=dispatch_worker, name="dispatcher", daemon=True)
+    thread.start()
+    logger.info(f"Started outbound dispatcher, reply interval: {reply_limit}s")
+    return thread
+
+
 def approve_friend_request(flag, approve=True):
-    url = f"{http_url}/set_friend_add_request"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-    }
+    action = "set_friend_add_request"
     data = {
         "flag": flag,
         "approve": approve
     }
-    return send_request(url, headers, data, flag, "friend_request")
+    return send_request(action, data, flag, "friend_request")
 
 
 def send_private_message(user_id, content):
-    url = f"{http_url}/send_private_msg"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-    }
+    action = "send_private_msg"
     data = {
         "user_id": user_id,
         "message": [
@@ -80,15 +238,11 @@ def send_private_message(user_id, content):
             }
         ]
     }
-    return send_request(url, headers, data, content)
+    return enqueue_request(action, data, content)
 
 
 def send_group_message(group_id, sender_id, content):
-    url = f"{http_url}/send_group_msg"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-    }
+    action = "send_group_msg"
     data = {
         "group_id": group_id,
         "message": [
@@ -102,15 +256,11 @@ def send_group_message(group_id, sender_id, content):
             }
         ]
     }
-    return send_request(url, headers, data, content)
+    return enqueue_request(action, data, content)
 
 
 def send_private_img(user_id, content):
-    url = f"{http_url}/send_private_msg"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-    }
+    action = "send_private_msg"
     data = {
         "user_id": user_id,
         "message": [
@@ -120,15 +270,11 @@ def send_private_img(user_id, content):
             }
         ]
     }
-    return send_request(url, headers, data, content, "image")
+    return enqueue_request(action, data, content, "image")
 
 
 def send_group_img(group_id, sender_id, content):
-    url = f"{http_url}/send_group_msg"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-    }
+    action = "send_group_msg"
     data = {
         "group_id": group_id,
         "message": [
@@ -142,15 +288,11 @@ def send_group_img(group_id, sender_id, content):
             }
         ]
     }
-    return send_request(url, headers, data, content, "image")
+    return enqueue_request(action, data, content, "image")
 
 
 def send_private_file(user_id, file_path):
-    url = f"{http_url}/send_private_msg"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-    }
+    action = "send_private_msg"
     data = {
         "user_id": user_id,
         "message": [
@@ -163,4 +305,4 @@ def send_private_file(user_id, file_path):
             }
         ]
     }
-    return send_request(url, headers, data, file_path, "file")
+    return enqueue_request(action, data, file_path, "file")
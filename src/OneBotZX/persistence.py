@@ -0,0 +1,112 @@
+import atexit
+import hashlib
+import pickle
+import signal
+import sys
+import threading
+from collections import defaultdict
+
+from loguru import logger
+
+from config_loader import zhixue_config
+from scheduler import run_every, stop_all
+
+save_interval = zhixue_config.save_interval
+
+writers = []
+flush_lock = threading.Lock()
+
+
+class WriteBehind:
+    """
+    延迟合并写入
+    mark 仅将数据标记为待写入，由后台线程每隔 save_interval 秒统一写入，期间对同一 key 的多次修改合并为一次写入。
+    与上次写入的内容相同时跳过，程序退出时写入全部剩余数据。
+    discard 使 key 的代数加一，写入前在锁内检查代数，已取出但在写入前被 discard 的数据不再写入。
+    """
+
+    def __init__(self, name: str, write: callable):
+        self.name = name
+        self.write = write
+        self.lock = threading.Lock()
+        self.pending = {}  # key -> 待写入的数据
+        self.digests = {}  # key -> 上次写入内容的摘要
+        self.generations = defaultdict(int)  # key -> discard 次数
+        self.merged = 0
+        self.skipped = 0
+        self.written = 0
+        writers.append(self)
+
+    def mark(self, key, value):
+        """标记数据待写入"""
+        with self.lock:
+            if key in self.pending:
+                self.merged += 1
+            self.pending[key] = value
+
+    def discard(self, key):
+        """
+        取消尚未写入的数据（如数据已被删除）
+        返回时该 key 正在进行的写入已完成，之后删除对应数据不会被覆盖
+        """
+        with self.lock:
+            self.pending.pop(key, None)
+            self.digests.pop(key, None)
+            self.generations[key] += 1
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            generations = {key: self.generations[key] for key in pending}
+        for key, value in pending.items():
+            try:
+                digest = hashlib.sha1(pickle.dumps(value)).digest()
+            except Exception:
+                digest = None
+            # 在锁内检查并写入，避免与 discard 交错
+            with self.lock:
+                if self.generations[key] != generations[key]:
+                    continue
+                if digest is not None and self.digests.get(key) == digest:
+                    self.skipped += 1
+                    continue
+                try:
+                    self.write(key, value)
+                except Exception as e:
+                    logger.error(f"Failed to write {self.name} {key}: {e}")
+                    self.pending.setdefault(key, value)
+                    continue
+                self.digests[key] = digest
+                self.written += 1
+        if pending:
+            logger.debug(f"Flushed {len(pending)} {self.name} entries")
+
+    def report(self) -> str:
+        return f"{self.name}: 写入 {self.written} 次，合并 {self.merged} 次，跳过未变化 {self.skipped} 次"
+
+
+def flush_all():
+    """写入全部待写入的数据"""
+    with flush_lock:
+        for writer in writers:
+            writer.flush()
+
+
+def shutdown(signum, frame):
+    """收到 SIGTERM（systemd、docker stop）时停止定时任务，写入全部待写入的数据后退出"""
+    logger.info(f"Received signal {signum}, flushing pending writes before exit")
+    stop_all()
+    flush_all()
+    sys.exit(0)
+
+
+def start_write_behind():
+    """需在主线程中调用"""
+    run_every(save_interval, flush_all, "write-behind")
+    atexit.register(flush_all)  # 正常退出及 Ctrl+C
+    signal.signal(signal.SIGTERM, shutdown)  # atexit 不会在 SIGTERM 时执行
+
+
+def get_write_stats() -> str:
+    """获得延迟写入统计"""
+    return "\n".join(writer.report() for writer in writers)
@@ -0,0 +1,94 @@
+import re
+from array import array
+
+from scores import ExamScoreTable
+
+EXCLUDED = -1.0  # 无法解析或被剔除的成绩，排在最后
+
+number_pattern = re.compile(r'-?\d+\.?\d*')
+
+
+def parse_score(value) -> float:
+    """
+    将成绩解析为数字
+    被剔除的成绩（如 "剔除(85)"）取其中的数字，无法解析时返回 EXCLUDED
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    value = str(value)
+    if "剔除" in value:
+        numbers = number_pattern.findall(value)
+        if numbers:
+            try:
+                return float(numbers[0])
+            except ValueError:
+                return EXCLUDED
+        return EXCLUDED
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return EXCLUDED
+
+
+def get_score_keys(table: ExamScoreTable, column: int):
+    """
+    将一个学科的成绩解析为数字列，每个成绩只解析一次
+    Return:
+        tuple: 参加该学科的行号, 对应的成绩
+    """
+    rows = array("l")
+    keys = array("d")
+    scores = table.score_columns[column]
+    for row, score in enumerate(scores):
+        if score == score:  # 非 NaN，即已按数字存储
+            rows.append(row)
+            keys.append(score)
+        elif table.has_subject(column, row):
+            rows.append(row)
+            keys.append(parse_score(table.raw_values["score"][column].get(row)))
+    return rows, keys
+
+
+def rank_column(table: ExamScoreTable, column: int):
+    """
+    计算单个学科的年级及班级排名
+    按成绩降序排序一次，年级排名与各班级排名在同一次遍历中得到。
+    并列成绩名次相同，其后名次跳过（如 1, 1, 3）；EXCLUDED 的名次为参与排名的人数。
+    """
+    rows, keys = get_score_keys(table, column)
+    order = sorted(range(len(rows)), key=keys.__getitem__, reverse=True)
+    class_index = table.class_index
+    class_sizes = {}
+    for row in rows:
+        class_sizes[class_index[row]] = class_sizes.get(class_index[row], 0) + 1
+
+    school_ranks = table.school_rank_columns[column]
+    class_ranks = table.class_rank_columns[column]
+    total = len(rows)
+    school_rank, prev_score = 1, None
+    class_state = {}  # 班级 -> [已排名人数, 当前名次, 上一成绩]
+    for i, index in enumerate(order):
+        row, score = rows[index], keys[index]
+        cls = class_index[row]
+        state = class_state.setdefault(cls, [0, 1, None])
+        if score == EXCLUDED:
+            school_ranks[row] = total
+            class_ranks[row] = class_sizes[cls]
+        else:
+            if prev_score is not None and score != prev_score:
+                school_rank = i + 1
+            if state[2] is not None and score != state[2]:
+                state[1] = state[0] + 1
+            school_ranks[row] = school_rank
+            class_ranks[row] = state[1]
+        prev_score = score
+        state[0] += 1
+        state[2] = score
+        table.raw_values["classrank"][column].pop(row, None)
+        table.raw_values["schoolrank"][column].pop(row, None)
+
+
+def rank_table(table: ExamScoreTable):
+    """重新计算成绩表中所有学科（含总分）的年级及班级排名"""
+    for column in range(len(table.subjects)):
+        rank_column(table, column)
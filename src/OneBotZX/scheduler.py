@@ -0,0 +1,38 @@
+import threading
+import time
+
+from loguru import logger
+
+stop_event = threading.Event()
+
+
+def run_every(interval: float, func: callable, name: str, initial_delay: float = None) -> threading.Thread:
+    """
+    在后台线程中每隔 interval 秒执行一次 func
+    Args:
+        interval: 执行间隔（秒）
+        func: 要执行的函数
+        name: 任务名称，用于日志
+        initial_delay: 首次执行前的等待时间，默认为 interval
+    """
+    def loop():
+        if stop_event.wait(interval if initial_delay is None else initial_delay):
+            return
+        while True:
+            start = time.perf_counter()
+            try:
+                func()
+            except Exception:
+                logger.exception(f"Scheduled task {name} failed")
+            logger.debug(f"Scheduled task {name} finished in {time.perf_counter() - start:.2f}s")
+            if stop_event.wait(interval):
+                return
+
+    thread = threading.Thread(target=loop, name=f"scheduler-{name}", daemon=True)
+    thread.start()
+    logger.info(f"Scheduled task {name} every {interval}s")
+    return thread
+
+
+def stop_all():
+    stop_event.set()
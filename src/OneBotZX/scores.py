@@ -0,0 +1,255 @@
+import math
+from array import array
+
+DASH = "-"  # 接口中表示无成绩、无排名的值，与缺失值一样以哨兵存储，不单独保存
+NO_SUBJECT = -2  # 班级排名列中的哨兵：该学生无此学科成绩
+
+
+class Score:
+    __slots__ = ("name", "score", "classrank", "schoolrank", "subjectcode")
+
+    def __init__(self, name, score, classrank, schoolrank, subjectcode):
+        self.name = name
+        self.score = score
+        self.classrank = classrank
+        self.schoolrank = schoolrank
+        self.subjectcode = subjectcode
+
+    def __getstate__(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    def __setstate__(self, state):
+        # 兼容未使用 __slots__ 时的旧版缓存
+        for key, value in state.items():
+            setattr(self, key, value)
+
+
+class StudentScoreInfo:
+    __slots__ = ("username", "user_id", "label", "class_name", "scores")
+
+    def __init__(self, username, user_id, label, class_name, all_score, class_rank, school_rank):
+        self.username = username
+        self.user_id = user_id
+        self.label = label
+        self.class_name = class_name
+        self.scores = {"总分": Score("总分", all_score, class_rank, school_rank, -1)}
+
+    def add_subject_score(self, subject_name, score, class_rank, school_rank, subject_code):
+        self.scores[subject_name] = Score(subject_name, score, class_rank, school_rank, subject_code)
+
+    def __getstate__(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    def __setstate__(self, state):
+        for key, value in state.items():
+            setattr(self, key, value)
+
+
+class StudentScoreView:
+    """成绩表中一名学生的只读视图，用法与 StudentScoreInfo 相同"""
+    __slots__ = ("table", "row", "_scores")
+
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+        self._scores = None
+
+    @property
+    def username(self):
+        return self.table.usernames[self.row]
+
+    @property
+    def user_id(self):
+        return self.table.user_ids[self.row]
+
+    @property
+    def label(self):
+        return self.table.labels[self.row]
+
+    @property
+    def class_name(self):
+        return self.table.class_table[self.table.class_index[self.row]]
+
+    @property
+    def scores(self) -> dict:
+        if self._scores is None:
+            self._scores = self.table.get_row_scores(self.row)
+        return self._scores
+
+
+class ExamScoreTable:
+    """
+    单场考试成绩表
+    按列存储：各科成绩与排名存储在 array 中，学科及班级名称只保存一次。
+    "-" 及缺失值以 NaN / -1 存储，其余无法以数字存储的原始值（如 "剔除(85)"）按列保存在 raw_values 中。
+    在构建或读取时按学生 ID、姓名及班级建立索引，查询时无需遍历全部学生。
+    按行访问时返回 StudentScoreView。
+    """
+
+    def __init__(self, students=None):
+        self.usernames = []
+        self.user_ids = []
+        self.labels = []
+        self.class_table = []
+        self.class_index = array("l")
+        self.subjects = []  # 学科名称，第 i 个学科对应第 i 列
+        self.subject_codes = []
+        self.score_columns = []
+        self.class_rank_columns = []
+        self.school_rank_columns = []
+        self.raw_values = {kind: [] for kind in ("score", "classrank", "schoolrank")}  # 类型 -> 各列的 {行号: 原始值}
+        self.signature = None  # 抓取时成绩单的签名，用于判断考试数据是否变化
+        strings = {}
+        classes = {}
+        for row, student in enumerate(students or []):
+            self.usernames.append(student.username)
+            self.user_ids.append(student.user_id)
+            self.labels.append(strings.setdefault(student.label, student.label))
+            if student.class_name not in classes:
+                classes[student.class_name] = len(self.class_table)
+                self.class_table.append(student.class_name)
+            self.class_index.append(classes[student.class_name])
+            for score in student.scores.values():
+                column = self.get_subject_column(score.name, score.subjectcode, row)
+                if len(self.score_columns[column]) > row:  # 重复的学科
+                    continue
+                self.set_value("score", column, row, score.score)
+                self.set_value("classrank", column, row, score.classrank)
+                self.set_value("schoolrank", column, row, score.schoolrank)
+            for column in range(len(self.subjects)):
+                if len(self.score_columns[column]) == row:  # 该学生无此学科成绩
+                    self.score_columns[column].append(math.nan)
+                    self.class_rank_columns[column].append(NO_SUBJECT)
+                    self.school_rank_columns[column].append(-1)
+        self.build_index()
+
+    def get_subject_column(self, name, code, rows):
+        if name in self.subjects:
+            return self.subjects.index(name)
+        self.subjects.append(name)
+        self.subject_codes.append(code)
+        self.score_columns.append(array("d", [math.nan] * rows))
+        self.class_rank_columns.append(array("l", [NO_SUBJECT] * rows))
+        self.school_rank_columns.append(array("l", [-1] * rows))
+        for raw in self.raw_values.values():
+            raw.append({})
+        return len(self.subjects) - 1
+
+    def set_value(self, kind, column, row, value):
+        if kind == "score":
+            target, missing = self.score_columns[column], math.nan
+            try:
+                number = float(value)
+                valid = not math.isnan(number)
+            except (TypeError, ValueError):
+                valid = False
+        else:
+            target = self.class_rank_columns[column] if kind == "classrank" else self.school_rank_columns[column]
+            missing = -1
+            try:
+                number = int(value)
+                valid = number >= 0 and str(number) == str(value).strip()
+            except (TypeError, ValueError):
+                valid = False
+        if valid:
+            target.append(number)
+        else:
+            target.append(missing)
+            if value is not None and value != DASH:
+                self.raw_values[kind][column][row] = value
+
+    def get_value(self, kind, column, row):
+        if kind == "score":
+            value = self.score_columns[column][row]
+            if math.isnan(value):
+                return self.raw_values[kind][column].get(row, DASH)
+            return int(value) if value.is_integer() else value
+        target = self.class_rank_columns[column] if kind == "classrank" else self.school_rank_columns[column]
+        value = target[row]
+        if value < 0:
+            return self.raw_values[kind][column].get(row, DASH)
+        return value
+
+    def has_subject(self, column, row):
+        return self.class_rank_columns[column][row] != NO_SUBJECT
+
+    def get_row_scores(self, row) -> dict:
+        scores = {}
+        for column, name in enumerate(self.subjects):
+            if self.has_subject(column, row):
+                scores[name] = Score(name, self.get_value("score", column, row),
+                                     self.get_value("classrank", column, row),
+                                     self.get_value("schoolrank", column, row), self.subject_codes[column])
+        return scores
+
+    def build_index(self):
+        self.by_user_id = {}
+        self.by_username = {}
+        self.by_class = {}
+        for row, (user_id, username) in enumerate(zip(self.user_ids, self.usernames)):
+            self.by_user_id[user_id] = row
+            self.by_username.setdefault(username, []).append(row)
+            self.by_class.setdefault(self.class_table[self.class_index[row]], []).append(row)
+
+    def __iter__(self):
+        return (StudentScoreView(self, row) for row in range(len(self.user_ids)))
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def __getstate__(self):
+        # 索引不参与序列化，读取时重建
+        state = self.__dict__.copy()
+        for key in ("by_user_id", "by_username", "by_class"):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        if "students" in state:
+            # 按行存储的旧版成绩表
+            self.__init__(state["students"])
+            return
+        self.signature = None
+        self.__dict__.update(state)
+        if any(isinstance(key, tuple) for key in self.raw_values):
+            self.convert_raw_values()
+        self.build_index()
+
+    def convert_raw_values(self):
+        """转换以 (列名, 学科序号, 行号) 为键保存原始值的旧版成绩表"""
+        old = self.raw_values
+        self.raw_values = {kind: [{} for _ in self.subjects] for kind in ("score", "classrank", "schoolrank")}
+        for column, scores in enumerate(self.score_columns):
+            for row, score in enumerate(scores):
+                if math.isnan(score) and ("score", column, row) not in old:
+                    self.class_rank_columns[column][row] = NO_SUBJECT
+        for (kind, column, row), value in old.items():
+            if value is not None and value != DASH:
+                self.raw_values[kind][column][row] = value
+
+    @classmethod
+    def wrap(cls, data):
+        """将旧版缓存中的学生成绩列表转换为成绩表"""
+        if isinstance(data, cls):
+            return data
+        return cls(data)
+
+    def get_by_user_id(self, user_id):
+        """
+        根据学生 ID 查询成绩
+        Return:
+            StudentScoreView: 学生成绩，不存在时返回 None
+        """
+        row = self.by_user_id.get(user_id)
+        return StudentScoreView(self, row) if row is not None else None
+
+    def find_by_username(self, username) -> list:
+        """根据学生姓名查询成绩，可能存在重名"""
+        return [StudentScoreView(self, row) for row in self.by_username.get(username, [])]
+
+    def get_class(self, class_name) -> list:
+        """获得指定班级全部学生成绩"""
+        return [StudentScoreView(self, row) for row in self.by_class.get(class_name, [])]
+
+    def class_names(self) -> list:
+        return list(self.by_class)
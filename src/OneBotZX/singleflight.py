@@ -0,0 +1,66 @@
+import threading
+from collections import defaultdict
+
+from loguru import logger
+
+
+class Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    合并相同的并发调用
+    同一 key 的调用同时只执行一次，执行期间到达的相同调用等待其完成并共享结果（或异常）。
+    key 的第一项为操作名称，用于统计。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.executed = defaultdict(int)
+        self.shared = defaultdict(int)
+
+    def do(self, key: tuple, func: callable, *args, **kwargs):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+                self.executed[key[0]] += 1
+            else:
+                call.waiters += 1
+                self.shared[key[0]] += 1
+        if not leader:
+            logger.debug(f"Waiting for in-flight call: {key}")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        if call.waiters:
+            logger.info(f"Shared result of {key} with {call.waiters} waiting calls")
+        return call.result
+
+    def report(self) -> str:
+        """获得各操作的实际执行次数及被合并的重复调用次数"""
+        with self.lock:
+            if not self.executed:
+                return "暂无合并记录。"
+            return "\n".join(f"{name}: 执行 {self.executed[name]} 次，合并重复调用 {self.shared[name]} 次"
+                             for name in sorted(self.executed))
+
+
+flights = SingleFlight()
@@ -0,0 +1,30 @@
+import time
+from contextlib import contextmanager
+
+from loguru import logger
+
+process_start = time.perf_counter()
+import_times = {}
+
+
+@contextmanager
+def import_timer(name: str):
+    """记录一个模块的导入耗时，其依赖中此前尚未导入的模块一并计入"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        import_times[name] = time.perf_counter() - start
+
+
+def get_startup_report() -> str:
+    """获得启动耗时报告"""
+    lines = [f"{name}: {elapsed * 1000:.0f}ms" for name, elapsed in import_times.items()]
+    lines.append(f"启动至今: {time.perf_counter() - process_start:.1f}s")
+    return "\n".join(lines)
+
+
+def log_startup_report():
+    total = sum(import_times.values())
+    details = ", ".join(f"{name} {elapsed * 1000:.0f}ms" for name, elapsed in import_times.items())
+    logger.info(f"Imported modules in {total * 1000:.0f}ms ({details})")
@@ -0,0 +1,150 @@
+import os
+import pickle
+import sqlite3
+import threading
+
+from loguru import logger
+
+DB_PATH = "./.zx/data/state.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS students (qqid TEXT PRIMARY KEY, account BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS teachers (school_id TEXT PRIMARY KEY, account BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS bans (qqid INTEGER PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS exam_meta (
+    exam_id TEXT PRIMARY KEY,
+    school_id TEXT,
+    signature TEXT,
+    fetched_at REAL NOT NULL,
+    checked_at REAL NOT NULL,
+    changed_at REAL NOT NULL
+);
+"""
+
+EXAM_META_FIELDS = ("school_id", "signature", "fetched_at", "checked_at", "changed_at")
+
+# 旧版 pickle 文件 -> 对应的表
+LEGACY_FILES = {
+    "students": "./.zx/data/stu_list.pkl",
+    "teachers": "./.zx/data/tch_list.pkl",
+    "bans": "./.zx/config/ban_list.pkl",
+    "exam_meta": "./.zx/data/exam_meta.pkl",
+}
+
+
+class StateStore:
+    """
+    基于 SQLite 的状态存储
+    学生账号、教师账号、封禁列表及考试元数据按行存储，每次修改只写入对应的行，并在事务中完成。
+    账号对象以 pickle 序列化后存储。
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def execute(self, sql: str, params=()):
+        with self.lock, self.conn:
+            self.conn.execute(sql, params)
+
+    def query(self, sql: str, params=()) -> list:
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def load_accounts(self, table: str, key: str) -> dict:
+        accounts = {}
+        for row_key, blob in self.query(f"SELECT {key}, account FROM {table}"):
+            try:
+                accounts[row_key] = pickle.loads(blob)
+            except Exception as e:
+                logger.error(f"Failed to load {table} {row_key}: {e}")
+        logger.success(f"Successfully loaded {len(accounts)} {table}")
+        return accounts
+
+    def load_students(self) -> dict:
+        """
+        Return:
+            dict: QQ 号 -> 学生账号
+        """
+        return self.load_accounts("students", "qqid")
+
+    def save_student(self, qqid, account):
+        self.execute("INSERT OR REPLACE INTO students (qqid, account) VALUES (?, ?)", (str(qqid), pickle.dumps(account)))
+
+    def delete_student(self, qqid):
+        self.execute("DELETE FROM students WHERE qqid = ?", (str(qqid),))
+
+    def load_teachers(self) -> dict:
+        """
+        Return:
+            dict: 学校 ID -> 教师账号
+        """
+        return self.load_accounts("teachers", "school_id")
+
+    def save_teacher(self, school_id, account):
+        self.execute("INSERT OR REPLACE INTO teachers (school_id, account) VALUES (?, ?)",
+                     (str(school_id), pickle.dumps(account)))
+
+    def load_bans(self) -> list:
+        return [row[0] for row in self.query("SELECT qqid FROM bans")]
+
+    def add_ban(self, qqid):
+        self.execute("INSERT OR IGNORE INTO bans (qqid) VALUES (?)", (int(qqid),))
+
+    def remove_ban(self, qqid):
+        self.execute("DELETE FROM bans WHERE qqid = ?", (int(qqid),))
+
+    def load_exam_meta(self) -> dict:
+        """
+        Return:
+            dict: 考试 ID -> 考试元数据
+        """
+        rows = self.query(f"SELECT exam_id, {', '.join(EXAM_META_FIELDS)} FROM exam_meta")
+        return {row[0]: dict(zip(EXAM_META_FIELDS, row[1:])) for row in rows}
+
+    def save_exam_meta(self, exam_id, meta: dict):
+        self.execute(f"INSERT OR REPLACE INTO exam_meta (exam_id, {', '.join(EXAM_META_FIELDS)}) VALUES (?, ?, ?, ?, ?, ?)",
+                     (str(exam_id), *(meta[field] for field in EXAM_META_FIELDS)))
+
+    def clear(self, table: str):
+        """清空表"""
+        if table not in LEGACY_FILES:
+            raise ValueError(f"Unknown table: {table}")
+        self.execute(f"DELETE FROM {table}")
+
+    def migrate_legacy_files(self):
+        """将旧版 pickle 文件导入数据库，导入后将原文件重命名为 .bak"""
+        for table, path in LEGACY_FILES.items():
+            if not os.path.exists(path):
+                continue
+            try:
+                with open(path, "rb") as f:
+                    data = pickle.load(f)
+                with self.lock, self.conn:
+                    if table == "students":
+                        self.conn.executemany("INSERT OR REPLACE INTO students (qqid, account) VALUES (?, ?)",
+                                              [(str(qqid), pickle.dumps(stu)) for qqid, stu in data.items()])
+                    elif table == "teachers":
+                        self.conn.executemany("INSERT OR REPLACE INTO teachers (school_id, account) VALUES (?, ?)",
+                                              [(str(school), pickle.dumps(tch)) for school, tch in data.items()])
+                    elif table == "bans":
+                        self.conn.executemany("INSERT OR IGNORE INTO bans (qqid) VALUES (?)",
+                                              [(int(qqid),) for qqid in data])
+                    else:
+                        self.conn.executemany(
+                            f"INSERT OR REPLACE INTO exam_meta (exam_id, {', '.join(EXAM_META_FIELDS)}) "
+                            f"VALUES (?, ?, ?, ?, ?, ?)",
+                            [(str(exam_id), *(meta[field] for field in EXAM_META_FIELDS))
+                             for exam_id, meta in data.items()])
+                os.replace(path, f"{path}.bak")
+                logger.success(f"Successfully migrated {len(data)} rows from {path} to {table}")
+            except Exception as e:
+                logger.error(f"Failed to migrate {path}: {e}")
+
+
+state_store = StateStore(DB_PATH)
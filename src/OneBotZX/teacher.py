@@ -1,34 +1,22 @@
+import hashlib
 import json
-import re
-from time import sleep
-from typing import List
+import threading
+from collections import OrderedDict
+from typing import List, Optional
 
 from loguru import logger
 from zhixuewang.teacher import TeacherAccount
 
-from answersheet import draw_answersheet
+from crawler import PageCrawler
+from jobs import report_progress
 from models import ZhixueError
+from ranking import rank_table
+from scores import Score, StudentScoreInfo, ExamScoreTable  # 旧版缓存通过 teacher 模块引用这些类
 
+LAYOUT_CACHE_SIZE = 64  # 缓存的答题卡版面（学科）数量
 
-class Score:
-    def __init__(self, name, score, classrank, schoolrank, subjectcode):
-        self.name = name
-        self.score = score
-        self.classrank = classrank
-        self.schoolrank = schoolrank
-        self.subjectcode = subjectcode
-
-
-class StudentScoreInfo:
-    def __init__(self, username, user_id, label, class_name, all_score, class_rank, school_rank):
-        self.username = username
-        self.user_id = user_id
-        self.label = label
-        self.class_name = class_name
-        self.scores = {"总分": Score("总分", all_score, class_rank, school_rank, -1)}
-
-    def add_subject_score(self, subject_name, score, class_rank, school_rank, subject_code):
-        self.scores[subject_name] = Score(subject_name, score, class_rank, school_rank, subject_code)
+layout_cache = OrderedDict()
+layout_cache_lock = threading.Lock()
 
 
 def get_all_exam_list(myaccount: TeacherAccount) -> List:
@@ -123,24 +111,30 @@ def get_exam_subjects(myaccount: TeacherAccount, examid: str) -> dict:
         },
         headers={"token": myaccount.get_token()},
     )
-    subjects = json.loads(r.json()["result"]["allSubjectTopicSetListJSON"])
+    return parse_exam_subjects(r.json()["result"])
+
+
+def parse_exam_subjects(result: dict) -> dict:
+    """从 getAllSubjectStudentRank 的返回结果中解析学科列表"""
+    subjects = json.loads(result["allSubjectTopicSetListJSON"])
     subjectslist = {}
     for subject in subjects:
         subjectslist[subject["subjectCode"]] = {"id": subject["topicSetId"], "name": subject["subjectName"]}
     return subjectslist
 
 
-def get_school_rank_by_stu_code(myaccount: TeacherAccount, examid: str, stu_code: str) -> List:
+def get_school_rank_by_stu_code(myaccount: TeacherAccount, examid: str, stu_code: str,
+                                user_id: str = None) -> Optional[StudentScoreInfo]:
     """
-    根据 stu_code 获得学校排名
+    根据 stu_code 获得单个学生的成绩及排名，仅需一次请求
     Args:
         myaccount: 教师账号
         examid: 考试 ID
         stu_code: 准考证号
+        user_id: 学生 ID，用于在多个搜索结果中确定学生
     Return:
-        List: 每科学校排名
+        StudentScoreInfo: 学生成绩，未找到时返回 None
     """
-    subjects = get_exam_subjects(myaccount, examid)
     r = myaccount.get_session().post(
         "https://www.zhixue.com/api-teacher/api/studentScore/getAllSubjectStudentRank",
         data={
@@ -151,96 +145,34 @@ def get_school_rank_by_stu_code(myaccount: TeacherAccount, examid: str, stu_code
         },
         headers={"token": myaccount.get_token()},
     )
-    data = r.json()["result"]["studentRank"][0]
-    total_score = Score("总分", data["allScore"], data["classRank"], data["schoolRank"], -1)
-    subject_scores = [total_score]
-    score_info = data["scoreInfos"]
-    for info in score_info:
-        subject_code = info["subjectCode"]
-        subject_name = subjects[subject_code]["name"]
-        subject_scores.append(Score(subject_name, info["score"], info["classRank"], info["schoolRank"], subject_code))
-    return subject_scores
-
-
-def calc_rank(student_list):
-    def parse_score(score_str):
-        if isinstance(score_str, (int, float)):
-            return float(score_str)
-
-        score_str = str(score_str)
-
-        # 提取数字
-        if "剔除" in score_str:
-            numbers = re.findall(r'-?\d+\.?\d*', score_str)
-            if numbers:
-                try:
-                    return float(numbers[0])
-                except ValueError:
-                    return -1
-            return -1
-
-        # 直接转换
-        try:
-            return float(score_str)
-        except (ValueError, TypeError):
-            return -1
-
-    # 按科目分组
-    subject_scores = {}
-    for student in student_list:
-        for subject_name, score_obj in student.scores.items():
-            if subject_name not in subject_scores:
-                subject_scores[subject_name] = []
-            subject_scores[subject_name].append((student, score_obj))
-
-    for subject_name, scores in subject_scores.items():
-        # 按班级分组
-        class_groups = {}
-        for student, score_obj in scores:
-            if student.class_name not in class_groups:
-                class_groups[student.class_name] = []
-            class_groups[student.class_name].append((student, score_obj))
-
-        # 计算年级排名
-        sorted_scores = sorted(scores, key=lambda x: parse_score(x[1].score), reverse=True)
-        current_rank = 1
-        prev_score = None
-        for i, (student, score_obj) in enumerate(sorted_scores):
-            current_score = parse_score(score_obj.score)
-            if current_score == -1:
-                score_obj.schoolrank = len(sorted_scores)
-            else:
-                if prev_score is not None and current_score != prev_score:
-                    current_rank = i + 1
-                score_obj.schoolrank = current_rank
-            prev_score = current_score
-
-        # 计算班级排名
-        for class_name, class_scores in class_groups.items():
-            sorted_class_scores = sorted(class_scores, key=lambda x: parse_score(x[1].score), reverse=True)
-            current_rank = 1
-            prev_score = None
-            for i, (student, score_obj) in enumerate(sorted_class_scores):
-                current_score = parse_score(score_obj.score)
-                if current_score == -1:
-                    score_obj.classrank = len(sorted_class_scores)
-                else:
-                    if prev_score is not None and current_score != prev_score:
-                        current_rank = i + 1
-                    score_obj.classrank = current_rank
-                prev_score = current_score
-
-
-def get_exam_all_rank(myaccount: TeacherAccount, examid: str) -> List:
-    """
-    获得全部成绩单
-    Args:
-        myaccount: 教师账号
-        examid: 考试 ID
-    Return:
-        List: 成绩单
-    """
-    logger.info(f"Getting exam data: {examid}")
+    if "<html" in r.text:
+        raise ZhixueError("Failed to get student rank")
+    result = r.json()["result"]
+    try:
+        subjects = parse_exam_subjects(result)
+    except (KeyError, TypeError, ValueError):
+        subjects = get_exam_subjects(myaccount, examid)
+    for data in result["studentRank"]:
+        if user_id is not None and data["userId"] != user_id:
+            continue
+        student_info = StudentScoreInfo(data["userName"], data["userId"], data["studentLabel"], data["className"],
+                                        data["allScore"], data["classRank"], data["schoolRank"])
+        for info in data["scoreInfos"]:
+            subject_code = info["subjectCode"]
+            subject_name = subjects[subject_code]["name"]
+            student_info.add_subject_score(subject_name, info["score"], info["classRank"], info["schoolRank"],
+                                           subject_code)
+        return student_info
+    return None
+
+
+def has_missing_rank(student: StudentScoreInfo) -> bool:
+    """上游是否未给出排名（需要通过 rank_table 计算）"""
+    return any("-" in str(score.classrank) or "-" in str(score.schoolrank) for score in student.scores.values())
+
+
+def get_exam_first_page(myaccount: TeacherAccount, examid: str) -> dict:
+    """获得成绩单第一页"""
     r = myaccount.get_session().post(
         "https://www.zhixue.com/api-teacher/api/studentScore/getAllSubjectStudentRank",
         data={
@@ -250,19 +182,83 @@ def get_exam_all_rank(myaccount: TeacherAccount, examid: str) -> List:
         },
         headers={"token": myaccount.get_token()},
     )
-    pages = r.json()["result"]["paperInfo"]["totalPage"]
+    if "<html" in r.text:
+        raise ZhixueError("Failed to get exam data")
+    return r.json()["result"]
+
+
+def get_exam_rank_page(myaccount: TeacherAccount, examid: str, page: int) -> dict:
+    """获得成绩单指定页"""
+    r = myaccount.get_session().post(
+        "https://www.zhixue.com/api-teacher/api/studentScore/getAllSubjectStudentRank",
+        data={
+            "examId": examid,
+            "pageIndexInt": page,
+        },
+        timeout=30,
+    )
+    if "<html" in r.text:
+        raise ZhixueError("Received HTML response")
+    try:
+        return r.json()["result"]
+    except Exception:
+        raise ZhixueError(f"Invalid response: {r.text[:100]}")
+
+
+def get_exam_signature(first_page: dict, last_page: Optional[dict]) -> str:
+    """
+    根据成绩单第一页和最后一页生成考试数据签名
+    新增成绩、阅卷进度变化等会改变总页数或首尾两页（含缺考、未出分的学生）的内容。
+    仅影响中间页的个别改分无法检测，由超过 exam_finished_ttl 后的完整重新抓取兜底
+    Args:
+        first_page: get_exam_first_page 的返回结果
+        last_page: 成绩单最后一页，没有成绩时为 None
+    Return:
+        str: 签名
+    """
+    content = json.dumps([first_page["paperInfo"]["totalPage"], first_page["studentRank"],
+                          last_page["studentRank"] if last_page else []],
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def probe_exam_signature(myaccount: TeacherAccount, examid: str) -> str:
+    """请求成绩单第一页和最后一页，获得考试数据签名"""
+    first_page = get_exam_first_page(myaccount, examid)
+    pages = first_page["paperInfo"]["totalPage"]
+    last_page = get_exam_rank_page(myaccount, examid, pages) if pages > 0 else None
+    return get_exam_signature(first_page, last_page)
+
+
+def get_exam_all_rank(myaccount: TeacherAccount, examid: str, concurrency=None) -> ExamScoreTable:
+    """
+    获得全部成绩单
+    Args:
+        myaccount: 教师账号
+        examid: 考试 ID
+        concurrency: 最大并发请求数，默认为 crawl_concurrency
+    Return:
+        ExamScoreTable: 成绩单
+    """
+    logger.info(f"Getting exam data: {examid}")
+    first_page = get_exam_first_page(myaccount, examid)
+    pages = first_page["paperInfo"]["totalPage"]
     subjects = get_exam_subjects(myaccount, examid)
+
+    def fetch_page(page):
+        return get_exam_rank_page(myaccount, examid, page)
+
+    crawler = PageCrawler(f"exam {examid}", concurrency)
+    fetched = []
+
+    def on_page(page, data):
+        fetched.append(page)
+        report_progress(f"已抓取成绩单 {len(fetched)}/{pages} 页")
+
+    pages_data = crawler.crawl(list(range(1, pages + 1)), fetch_page, on_page)
     students_list = []
     need_calc_rank = False
-    for page in range(1, pages + 1):
-        r = myaccount.get_session().post(
-            "https://www.zhixue.com/api-teacher/api/studentScore/getAllSubjectStudentRank",
-            data={
-                "examId": examid,
-                "pageIndexInt": page,
-            }
-        )
-        data = r.json()["result"]
+    for data in pages_data:
         for student in data["studentRank"]:
             student_info = StudentScoreInfo(student["userName"], student["userId"], student["studentLabel"],
                                             student["className"], student["allScore"], student["classRank"],
@@ -274,37 +270,21 @@ def get_exam_all_rank(myaccount: TeacherAccount, examid: str) -> List:
                 student_info.add_subject_score(subject_name, score_info["score"], score_info["classRank"],
                                                score_info["schoolRank"], score_info["subjectCode"])
             students_list.append(student_info)
-        sleep(0.5)
+    table = ExamScoreTable(students_list)
     if need_calc_rank:
-        calc_rank(students_list)
-    return students_list
+        rank_table(table)
+    table.signature = get_exam_signature(first_page, pages_data[-1] if pages_data else None)
+    return table
 
 
-def get_answersheet_data(myaccount: TeacherAccount, subjectid: str, stuid: str):  # FIXME: 某些答题卡数据格式不同(统考语文)
+def parse_answersheet_layout(data: dict):
     """
-    获取答题卡数据
+    解析答题卡版面（同一学科所有学生相同）
     Args:
-        myaccount: 教师账号
-        subjectid: 学科 ID
-        stuid: 学生 ID
+        data: getNewCheckSheet 返回结果，sheetDatas 需已解析
     Return:
-        tuple: 题号对应情况, 每页位置信息, 客观题答案, 作答及批改详情, 原卷链接, 纸张类型
+        tuple: 题号对应情况, 每页位置信息, 纸张类型
     """
-    r = myaccount.get_session().post(
-        "https://www.zhixue.com/api-classreport/class/student/getNewCheckSheet/",
-        data={
-            "topicSetId": subjectid,
-            "userId": stuid,
-        },
-        headers={"token": myaccount.get_token()},
-    )
-
-    try:
-        data = r.json()["result"]
-        data["sheetDatas"] = json.loads(data["sheetDatas"])
-    except:
-        raise ZhixueError(r.text)
-
     topic_mapping = data["markingTopicDetail"]  # 题号对应情况
     page_positions = {}  # 每页位置信息
     page_index_origin = 0
@@ -351,6 +331,51 @@ def get_answersheet_data(myaccount: TeacherAccount, subjectid: str, stuid: str):
                 })
                 # logger.debug(f"Page {page_index}: {page_positions[page_index]}")
         page_index_origin +=1
+    paper_type = json.loads(data["answerSheetLocation"])["paperType"]  # 纸张类型
+    return topic_mapping, page_positions, paper_type
+
+
+def get_answersheet_layout(subjectid: str, data: dict):
+    """获得答题卡版面，按学科缓存"""
+    with layout_cache_lock:
+        if subjectid in layout_cache:
+            layout_cache.move_to_end(subjectid)
+            return layout_cache[subjectid]
+    layout = parse_answersheet_layout(data)
+    with layout_cache_lock:
+        layout_cache[subjectid] = layout
+        while len(layout_cache) > LAYOUT_CACHE_SIZE:
+            layout_cache.popitem(last=False)
+    return layout
+
+
+def get_answersheet_data(myaccount: TeacherAccount, subjectid: str, stuid: str):  # FIXME: 某些答题卡数据格式不同(统考语文)
+    """
+    获取答题卡数据
+    Args:
+        myaccount: 教师账号
+        subjectid: 学科 ID
+        stuid: 学生 ID
+    Return:
+        tuple: 题号对应情况, 每页位置信息, 客观题答案, 作答及批改详情, 原卷链接, 纸张类型
+    """
+    r = myaccount.get_session().post(
+        "https://www.zhixue.com/api-classreport/class/student/getNewCheckSheet/",
+        data={
+            "topicSetId": subjectid,
+            "userId": stuid,
+        },
+        headers={"token": myaccount.get_token()},
+    )
+
+    try:
+        data = r.json()["result"]
+        data["sheetDatas"] = json.loads(data["sheetDatas"])
+    except:
+        raise ZhixueError(r.text)
+
+    topic_mapping, page_positions, paper_type = get_answersheet_layout(subjectid, data)
+
     # 客观题答案
     objective_answer = {}
     for item in data["objectAnswer"]:
@@ -381,7 +406,6 @@ def get_answersheet_data(myaccount: TeacherAccount, subjectid: str, stuid: str):
             })
 
     sheet_images = data["sheetImages"]  # 原卷链接
-    paper_type = json.loads(data["answerSheetLocation"])["paperType"]  # 纸张类型
 
     return topic_mapping, page_positions, objective_answer, answer_details, sheet_images, paper_type
 
@@ -400,6 +424,8 @@ def process_answersheet(myaccount: TeacherAccount, subjectid: str, stuid: str):
     except Exception as e:
         logger.error(f"Failed to get answersheet data: {e}")
         raise ZhixueError("Failed to get answersheet data")
+    from answersheet import draw_answersheet  # 依赖 PIL，延迟导入以加快启动
+
     try:
         image = draw_answersheet(topic_mapping, page_positions, objective_answer, answer_details, sheet_images, paper_type)
     except Exception as e:
@@ -0,0 +1,191 @@
+import json
+import threading
+import time
+import uuid
+
+import websocket
+from loguru import logger
+
+from models import OnebotError
+
+RECONNECT_INTERVAL = 3
+
+reverse_connections = {}  # self_id -> ReverseWebSocket
+reverse_connections_lock = threading.Lock()
+
+
+class WebSocketTransport:
+    """
+    OneBot WebSocket 连接
+    通过 echo 字段匹配动作请求与响应，其余帧作为事件交给 on_event 处理
+    """
+
+    def __init__(self, on_event: callable):
+        self.on_event = on_event
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        self.connected = threading.Event()
+
+    def send_raw(self, text: str):
+        raise NotImplementedError
+
+    def is_connected(self) -> bool:
+        return self.connected.is_set()
+
+    def call(self, action: str, params: dict, timeout: float) -> dict:
+        """
+        调用 OneBot 动作并等待响应
+        Raises:
+            OnebotError: 连接不可用或等待响应超时
+        """
+        if not self.is_connected():
+            raise OnebotError("websocket not connected")
+        echo = uuid.uuid4().hex
+        waiter = [threading.Event(), None]
+        with self.pending_lock:
+            self.pending[echo] = waiter
+        try:
+            with self.send_lock:
+                self.send_raw(json.dumps({"action": action, "params": params, "echo": echo}))
+            if not waiter[0].wait(timeout):
+                raise OnebotError(f"websocket response timeout: {action}")
+        except OnebotError:
+            raise
+        except Exception as e:
+            raise OnebotError(f"websocket send failed: {e}")
+        finally:
+            with self.pending_lock:
+                self.pending.pop(echo, None)
+        if waiter[1] is None:
+            raise OnebotError("websocket disconnected")
+        return waiter[1]
+
+    def handle_frame(self, text: str):
+        try:
+            data = json.loads(text)
+        except ValueError:
+            logger.warning(f"Received invalid websocket frame: {text[:100]}")
+            return
+        echo = data.get("echo")
+        if echo is not None and "post_type" not in data:
+            with self.pending_lock:
+                waiter = self.pending.get(echo)
+            if waiter:
+                waiter[1] = data
+                waiter[0].set()
+            return
+        if "post_type" in data:
+            self.on_event(data)
+
+    def fail_pending(self):
+        """连接断开时唤醒所有等待响应的请求"""
+        with self.pending_lock:
+            for waiter in self.pending.values():
+                waiter[0].set()
+
+
+class ForwardWebSocket(WebSocketTransport):
+    """正向 WebSocket：主动连接 OneBot 实现，断开后自动重连"""
+
+    def __init__(self, url: str, access_token: str, on_event: callable):
+        super().__init__(on_event)
+        self.url = url
+        self.access_token = access_token
+        self.ws = None
+
+    def send_raw(self, text: str):
+        self.ws.send(text)
+
+    def run(self):
+        while True:
+            try:
+                header = [f"Authorization: Bearer {self.access_token}"] if self.access_token else []
+                self.ws = websocket.create_connection(self.url, header=header)
+                self.connected.set()
+                logger.success(f"Connected to OneBot websocket: {self.url}")
+                while True:
+                    frame = self.ws.recv()
+                    if not frame:
+                        break
+                    self.handle_frame(frame)
+            except Exception as e:
+                logger.warning(f"OneBot websocket disconnected: {e}")
+            finally:
+                self.connected.clear()
+                self.fail_pending()
+                if self.ws is not None:
+                    try:
+                        self.ws.close()
+                    except Exception:
+                        pass
+            time.sleep(RECONNECT_INTERVAL)
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name="onebot-ws", daemon=True)
+        thread.start()
+        return thread
+
+
+class ReverseWebSocket(WebSocketTransport):
+    """反向 WebSocket：由 OneBot 实现连接到本机，每个 self_id 对应一个连接"""
+
+    def __init__(self, ws, self_id: str, on_event: callable):
+        super().__init__(on_event)
+        self.ws = ws
+        self.self_id = self_id
+
+    def send_raw(self, text: str):
+        self.ws.send(text)
+
+    def serve(self):
+        """接收并处理帧，直到连接断开"""
+        register_reverse_connection(self)
+        try:
+            while True:
+                frame = self.ws.receive()
+                if frame is None:
+                    break
+                self.handle_frame(frame)
+        except Exception as e:
+            logger.warning(f"Reverse websocket {self.self_id} disconnected: {e}")
+        finally:
+            unregister_reverse_connection(self)
+            self.fail_pending()
+
+
+def register_reverse_connection(conn: ReverseWebSocket):
+    with reverse_connections_lock:
+        old_conn = reverse_connections.get(conn.self_id)
+        reverse_connections[conn.self_id] = conn
+    if old_conn is not None:
+        old_conn.connected.clear()
+        old_conn.fail_pending()
+    conn.connected.set()
+    logger.success(f"Reverse websocket connected: {conn.self_id}")
+
+
+def unregister_reverse_connection(conn: ReverseWebSocket):
+    conn.connected.clear()
+    with reverse_connections_lock:
+        if reverse_connections.get(conn.self_id) is conn:
+            del reverse_connections[conn.self_id]
+    logger.info(f"Reverse websocket closed: {conn.self_id}")
+
+
+def get_reverse_connection(self_id=None):
+    """
+    获得 self_id 对应的反向 WebSocket 连接
+    Args:
+        self_id: 机器人 QQ 号，为 None 时返回任意一个可用连接
+    Return:
+        ReverseWebSocket: 连接，不存在时返回 None
+    """
+    with reverse_connections_lock:
+        if self_id is not None:
+            conn = reverse_connections.get(str(self_id))
+        else:
+            conn = next(iter(reverse_connections.values()), None)
+    if conn is not None and conn.is_connected():
+        return conn
+    return None
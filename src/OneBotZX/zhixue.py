@@ -1,46 +1,390 @@
+import contextvars
+import csv
+import glob
 import json
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from loguru import logger
-from openpyxl import Workbook
 from zhixuewang.models import StuPerson
 
+from cache_manager import cache_manager
 from config_loader import zhixue_config
-from filesystem import save_cache, load_cache
-from login import update_login_status_self, login_by_captcha
-from models import ZhixueError, LoginCaptchaError, FailedGetTeacherAccountError
+from filesystem import save_exam_scores, load_exam_scores, migrate_exam_scores, \
+    get_exam_scores_version
+from jobs import current_job
+from login import update_login_status_self, login_by_captcha, call_with_relogin, add_relogin_listener, \
+    check_login_status
+from models import ZhixueError, LoginCaptchaError, FailedGetTeacherAccountError, JobCancelled
 from msg import send_private_message
-from teacher import get_exam_all_rank, get_exam_subjects, process_answersheet, get_stuid_by_stuname
+from persistence import WriteBehind
+from scheduler import run_every
+from scores import ExamScoreTable
+from singleflight import flights
+from store import state_store
+from teacher import get_all_exam_list, get_exam_all_rank, get_exam_subjects, process_answersheet, get_stuid_by_stuname, \
+    get_school_rank_by_stu_code, has_missing_rank, probe_exam_signature
 
 teacher_usernames = zhixue_config.teacher_accounts
 teacher_passwords = zhixue_config.teacher_passwords
+answersheet_workers = zhixue_config.answersheet_workers
+keepalive_interval = zhixue_config.keepalive_interval
+prefetch_interval = zhixue_config.prefetch_interval
+prefetch_hours = zhixue_config.prefetch_hours
+prefetch_latest = zhixue_config.prefetch_latest
+prefetch_concurrency = zhixue_config.prefetch_concurrency
+exam_refresh_ttl = zhixue_config.exam_refresh_ttl
+exam_finished_ttl = zhixue_config.exam_finished_ttl
+exam_finished_days = zhixue_config.exam_finished_days
+
+state_store.migrate_legacy_files()
+migrate_exam_scores()
 
 stu_list = {}
-tch_list = load_cache("tch_list")
-exam_scores_by_stu = {}
-exam_scores = {}
+tch_list = state_store.load_teachers()
+exam_meta = state_store.load_exam_meta()  # 考试 ID -> 成绩缓存的所属学校、签名、抓取/检查/变化时间
+exam_meta_lock = threading.Lock()
+
+teacher_writer = WriteBehind("teachers", state_store.save_teacher)
+student_writer = WriteBehind("students", state_store.save_student)
+exam_meta_writer = WriteBehind("exam_meta", state_store.save_exam_meta)
 
 # tch = login_by_captcha(USERNAME_TEACHER, PASSWORD_TEACHER)
 
-for teacher_account in teacher_usernames: # TODO: 自动维护（删除）不在配置文件中的账号
-    for tch_school in tch_list:
-        if tch_list[tch_school].username == teacher_account:
-            break
-    else:
-        tch_account = login_by_captcha(teacher_account, teacher_passwords[teacher_usernames.index(teacher_account)])
-        tch_school = tch_account.school.id
-        tch_list[tch_school] = tch_account
-        logger.success(f"Successfully initialized teacher account: {teacher_account}")
-    # if teacher_account not in tch_list:
-    #     tch_account = login_by_captcha(teacher_account, teacher_passwords[teacher_usernames.index(teacher_account)])
-    #     tch_school = tch_account.school.id
-    #     tch_list[tch_school] = tch_account
-save_cache("tch_list", tch_list)
+TEACHER_WAIT_TIMEOUT = 120  # 等待教师账号登录的最长时间（秒）
+
+
+class TeacherSlot:
+    """配置文件中的教师账号及其初始化状态"""
+
+    def __init__(self, username, password):
+        self.username = username
+        self.password = password
+        self.school_id = None
+        self.ready = False
+        self.login_time = None
+        self.error = None
+        self.retrying = False  # 初始化失败后正在重新登录
+
+
+tch_list_lock = threading.Lock()
+teacher_ready = threading.Condition(tch_list_lock)
+teacher_slots = {}
+for teacher_account, teacher_password in zip(teacher_usernames, teacher_passwords): # TODO: 自动维护（删除）不在配置文件中的账号
+    teacher_slots[teacher_account] = TeacherSlot(teacher_account, teacher_password)
+for tch_school in tch_list:
+    if tch_list[tch_school].username in teacher_slots:
+        teacher_slots[tch_list[tch_school].username].school_id = tch_school
+        teacher_slots[tch_list[tch_school].username].ready = True
+
+
+def login_teacher_slot(slot: TeacherSlot):
+    start = time.perf_counter()
+    try:
+        tch_account = login_by_captcha(slot.username, slot.password)
+    except Exception as e:
+        logger.error(f"Failed to initialize teacher account {slot.username}: {e}")
+        error = str(e) or type(e).__name__
+        tch_account = None
+    with teacher_ready:
+        slot.login_time = time.perf_counter() - start
+        if tch_account is not None:
+            slot.school_id = tch_account.school.id
+            tch_list[slot.school_id] = tch_account
+            teacher_writer.mark(slot.school_id, tch_account)
+            slot.error = None
+            logger.success(f"Successfully initialized teacher account: {slot.username} ({slot.login_time:.2f}s)")
+        else:
+            slot.error = error
+        slot.retrying = False
+        slot.ready = True
+        teacher_ready.notify_all()
+
+
+def init_teacher_accounts():
+    """在后台并行登录未缓存的教师账号"""
+    pending = [slot for slot in teacher_slots.values() if not slot.ready]
+    if not pending:
+        return
+    logger.info(f"Initializing {len(pending)} teacher accounts in background")
+    pool = ThreadPoolExecutor(max_workers=len(pending), thread_name_prefix="teacher-login")
+    for slot in pending:
+        pool.submit(login_teacher_slot, slot)
+    pool.shutdown(wait=False)
+
+
+def wait_for_school(school_id, timeout=TEACHER_WAIT_TIMEOUT) -> bool:
+    """
+    等待学校对应的教师账号可用，已可用时立即返回
+    尚未登录完成的账号所属学校未知，因此等待到该学校出现或全部账号初始化完成
+    Return:
+        bool: 教师账号是否可用
+    """
+    with teacher_ready:
+        return teacher_ready.wait_for(
+            lambda: school_id in tch_list or all(slot.ready for slot in teacher_slots.values()), timeout
+        ) and school_id in tch_list
+
+
+def get_teacher_status() -> str:
+    """获得各教师账号的初始化状态"""
+    lines = []
+    for slot in teacher_slots.values():
+        if slot.retrying:
+            status = f"重新登录中 (上次失败：{slot.error[:50]})"
+        elif not slot.ready:
+            status = "登录中"
+        elif slot.error:
+            status = f"登录失败 ({slot.error[:50]})"
+        else:
+            status = f"就绪，学校 {slot.school_id}"
+        login_time = f"，耗时 {slot.login_time:.1f}s" if slot.login_time is not None else ""
+        lines.append(f"{slot.username}: {status}{login_time}")
+    return "\n".join(lines) or "未配置教师账号。"
+
+
+def save_login_state(account):
+    """重新登录后保存新的 session，仅写入该账号对应的行"""
+    for school_id, tch in list(tch_list.items()):
+        if tch is account:
+            teacher_writer.mark(school_id, account)
+            return
+    for qqid, stu in list(stu_list.items()):
+        if stu is account:
+            student_writer.mark(qqid, account)
+            return
+
+
+add_relogin_listener(save_login_state)
+
+
+def keep_teachers_alive():
+    """检查全部教师账号的登录状态，过期的账号立即重新登录，初始化失败的账号重新尝试"""
+    for slot in list(teacher_slots.values()):
+        with teacher_ready:
+            if not (slot.ready and slot.error):
+                continue
+            # 重新登录完成前不视为就绪
+            slot.ready = False
+            slot.retrying = True
+        login_teacher_slot(slot)
+    for tch in list(tch_list.values()):
+        start = time.perf_counter()
+        try:
+            relogged = check_login_status(tch)
+        except Exception as e:
+            logger.error(f"Failed to keep teacher session alive: {tch.username}: {e}")
+            continue
+        if relogged:
+            logger.warning(f"Teacher session expired: {tch.username}, "
+                           f"renewed in {time.perf_counter() - start:.2f}s")
+        else:
+            logger.debug(f"Teacher session alive: {tch.username}")
+
+
+def start_teacher_keepalive():
+    if keepalive_interval > 0:
+        run_every(keepalive_interval, keep_teachers_alive, "teacher-keepalive")
+
+
+def get_school_id(qqid):
+    """获得 QQ 号对应学生所在学校 ID，学校无可用教师账号时抛出 FailedGetTeacherAccountError"""
+    stu_school = stu_list[qqid].clazz.school.id
+    if not wait_for_school(stu_school):
+        send_private_message(qqid, "暂不支持所在学校，请联系管理员。")
+        raise FailedGetTeacherAccountError
+    return stu_school
+
+
+def get_teacher(qqid):
+    """
+    获得 QQ 号对应学生所在学校的教师账号
+    Args:
+        qqid: QQ 号
+    Return:
+        TeacherAccount: 教师账号
+    """
+    stu_school = get_school_id(qqid)
+    tch_list[stu_school] = update_login_status_self(tch_list[stu_school])
+    return tch_list[stu_school]
+
+
+def get_cached_exam_scores(exam_id):
+    """
+    读取已缓存的考试成绩表
+    Args:
+        exam_id: 考试 ID
+    Return:
+        ExamScoreTable: 成绩表，未缓存时返回 None
+    """
+    data = load_exam_scores(exam_id)
+    if data is None or isinstance(data, ExamScoreTable):
+        return data
+    # 旧版缓存为学生成绩列表，转换后重新保存
+    table = ExamScoreTable.wrap(data)
+    save_exam_scores(exam_id, table)
+    return table
+
+
+def get_exam_ttl(meta: dict) -> float:
+    """成绩近期仍有变化（阅卷中）的考试使用较短的有效期，长时间未变化的考试使用较长的有效期"""
+    if time.time() - meta["changed_at"] < exam_finished_days * 86400:
+        return exam_refresh_ttl
+    return exam_finished_ttl
+
+
+def is_exam_fresh(exam_id) -> bool:
+    """考试成绩已缓存且在有效期内，读取时无需检查或抓取"""
+    with exam_meta_lock:
+        meta = dict(exam_meta[exam_id]) if exam_id in exam_meta else None
+    if meta is None or time.time() - meta["checked_at"] >= get_exam_ttl(meta):
+        return False
+    return get_cached_exam_scores(exam_id) is not None
+
+
+def record_exam_fetch(exam_id, school_id, table: ExamScoreTable):
+    """记录考试成绩的抓取时间，签名变化时同时记录变化时间"""
+    now = time.time()
+    with exam_meta_lock:
+        meta = exam_meta.get(exam_id)
+        changed = meta is None or meta["signature"] != table.signature
+        exam_meta[exam_id] = {
+            "school_id": school_id,
+            "signature": table.signature,
+            "fetched_at": now,
+            "checked_at": now,
+            "changed_at": now if changed else meta["changed_at"],
+        }
+        exam_meta_writer.mark(exam_id, dict(exam_meta[exam_id]))
+
+
+def mark_exam_checked(exam_id):
+    with exam_meta_lock:
+        exam_meta[exam_id]["checked_at"] = time.time()
+        exam_meta_writer.mark(exam_id, dict(exam_meta[exam_id]))
+
+
+def fetch_exam_scores(tch, exam_id, school_id, concurrency=None) -> ExamScoreTable:
+    """抓取全部成绩并保存，同一考试同时只抓取一次"""
+    def fetch():
+        students_scores_list = call_with_relogin(tch, get_exam_all_rank, tch, exam_id, concurrency)
+        save_exam_scores(exam_id, students_scores_list)
+        record_exam_fetch(exam_id, school_id, students_scores_list)
+        return students_scores_list
+
+    return flights.do(("exam_scores", exam_id), fetch)
+
+
+def refresh_exam_scores(qqid, exam_id, students_scores_list: ExamScoreTable) -> ExamScoreTable:
+    """
+    检查已缓存的考试成绩是否过期
+    过期时先请求成绩单第一页和最后一页，签名未变化则继续使用缓存，变化时才重新抓取全部成绩。
+    签名无法覆盖中间页的改分，距上次完整抓取超过 exam_finished_ttl 时不再比较签名，直接重新抓取
+    Args:
+        qqid: QQ 号
+        exam_id: 考试 ID
+        students_scores_list: 已缓存的成绩表
+    Return:
+        ExamScoreTable: 最新的成绩表，检查失败时返回已缓存的成绩表
+    """
+    with exam_meta_lock:
+        meta = dict(exam_meta[exam_id]) if exam_id in exam_meta else None
+    if meta is not None and time.time() - meta["checked_at"] < get_exam_ttl(meta):
+        return students_scores_list
+    school_id = get_school_id(qqid)
+    tch = get_teacher(qqid)
+
+    def check():
+        if meta is not None and meta["signature"] is not None \
+                and time.time() - meta["fetched_at"] < exam_finished_ttl:
+            if call_with_relogin(tch, probe_exam_signature, tch, exam_id) == meta["signature"]:
+                mark_exam_checked(exam_id)
+                logger.debug(f"Exam data unchanged: {exam_id}")
+                return students_scores_list
+            logger.info(f"Exam data changed: {exam_id}, refreshing")
+        elif meta is not None:
+            logger.info(f"Exam data last fetched over {exam_finished_ttl}s ago: {exam_id}, refreshing")
+        return fetch_exam_scores(tch, exam_id, school_id)
+
+    try:
+        return flights.do(("exam_refresh", exam_id), check)
+    except JobCancelled:
+        raise  # 任务已取消或超时，不再回退到已缓存的成绩
+    except Exception as e:
+        logger.warning(f"Failed to refresh exam scores {exam_id}: {e}")
+        return students_scores_list
+
+
+def get_exam_scores(qqid, exam_id) -> ExamScoreTable:
+    """获得考试成绩表，未缓存时抓取，缓存过期时检查并更新"""
+    students_scores_list = get_cached_exam_scores(exam_id)
+    if students_scores_list is not None:
+        return refresh_exam_scores(qqid, exam_id, students_scores_list)
+    school_id = get_school_id(qqid)
+    return fetch_exam_scores(get_teacher(qqid), exam_id, school_id)
+
+
+def force_refresh_exam(qqid, exam_id) -> ExamScoreTable:
+    """
+    立即重新抓取考试成绩
+    优先使用该考试所属学校的教师账号，未记录所属学校时使用 QQ 号对应学生所在学校的教师账号
+    """
+    with exam_meta_lock:
+        school_id = exam_meta.get(exam_id, {}).get("school_id")
+    if school_id is None or school_id not in tch_list:
+        school_id = get_school_id(qqid)
+    tch_list[school_id] = update_login_status_self(tch_list[school_id])
+    return fetch_exam_scores(tch_list[school_id], exam_id, school_id)
+
+
+def in_prefetch_hours(hour=None) -> bool:
+    """当前是否处于允许预取的时段，支持跨零点（如 [22, 7]）"""
+    start, end = prefetch_hours
+    hour = time.localtime().tm_hour if hour is None else hour
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+def prefetch_school_exams(school_id):
+    """检查学校最新的考试，抓取尚未缓存的考试成绩"""
+    tch = update_login_status_self(tch_list[school_id])
+    exams = call_with_relogin(tch, get_all_exam_list, tch)
+    for exam in exams[:prefetch_latest]:
+        exam_id = exam.split(",")[0].strip()
+        # 仅以成绩文件判断是否已缓存：清除成绩缓存后 exam_meta 仍保留，不能据此跳过
+        if get_exam_scores_version(exam_id):
+            continue
+        if not in_prefetch_hours():
+            return
+        logger.info(f"Prefetching new exam: {exam}")
+        try:
+            fetch_exam_scores(tch, exam_id, school_id, prefetch_concurrency)
+        except Exception as e:
+            logger.warning(f"Failed to prefetch exam {exam_id}: {e}")
+
+
+def prefetch_exams():
+    """依次检查各学校的新考试，仅在 prefetch_hours 时段内进行"""
+    if not in_prefetch_hours():
+        return
+    for school_id in list(tch_list):
+        try:
+            prefetch_school_exams(school_id)
+        except Exception as e:
+            logger.warning(f"Failed to check new exams of school {school_id}: {e}")
+
+
+def start_exam_prefetch():
+    if prefetch_interval > 0:
+        run_every(prefetch_interval, prefetch_exams, "exam-prefetch")
+
 
 def load_all_stu_list():
     global stu_list
-    stu_list = load_cache("stu_list")
+    stu_list = state_store.load_students()
 
 
 def get_user(qqid):
@@ -79,12 +423,11 @@ def login_stu(qqid, username, password):
         if Exception == LoginCaptchaError:
             return 4, None
         return 1, None
-    stu_list = load_cache("stu_list")
-    for qqid_, stu_ in stu_list.items():
+    for qqid_, stu_ in list(stu_list.items()):
         if stu_.id == stu.id:
             return 3, qqid_
     stu_list[qqid] = stu
-    save_cache("stu_list", stu_list)
+    state_store.save_student(qqid, stu)
     return 0, None
 
 
@@ -97,12 +440,11 @@ def logout_stu(qqid):
         str: 学生账号
         bool: 登出是否成功
     """
-    global stu_list
-    stu_list = load_cache("stu_list")
     if qqid in stu_list:
         username = stu_list[qqid].username
         del stu_list[qqid]
-        save_cache("stu_list", stu_list)
+        student_writer.discard(qqid)
+        state_store.delete_student(qqid)
         return username, True
     return None, False
 
@@ -153,7 +495,7 @@ def get_exams(qqid):
     stu, status = get_user(qqid)
     if not status:
         return None
-    exams = stu.get_exams()
+    exams = call_with_relogin(stu, stu.get_exams)
     returns = ""
     for i, exam in enumerate(exams):
         if i >= 10:
@@ -167,57 +509,65 @@ def get_rank_by_stu_code(qqid, exam_id):
     stu, status = get_user(qqid)
     if not status:
         return None
-    stu_school = stu_list[qqid].clazz.school.id
-    global tch_list
-    if stu_school not in tch_list:
-        send_private_message(qqid, "暂不支持所在学校，请联系管理员。")
-        raise FailedGetTeacherAccountError
-
-    # Refactor: get_exam_all_rank
-    global exam_scores
-    exam_scores = load_cache("exam_scores")
-    if exam_id not in exam_scores:
-        tch_list[stu_school] = update_login_status_self(tch_list[stu_school])
-        tch = tch_list[stu_school]
-        save_cache("tch_list", tch_list)
-        exam_scores[exam_id] = get_exam_all_rank(tch, exam_id)
-        save_cache("exam_scores", exam_scores)
-    students_scores_list = exam_scores[exam_id]
+    school_id = get_school_id(qqid)
+
+    students_scores_list = get_cached_exam_scores(exam_id)
+    if students_scores_list is not None:
+        students_scores_list = refresh_exam_scores(qqid, exam_id, students_scores_list)
+        student = students_scores_list.get_by_user_id(stu.id)
+        return format_student_scores(student) if student else None
+
+    tch = get_teacher(qqid)
+    student = None
+    if stu.code:
+        try:
+            student = call_with_relogin(tch, get_school_rank_by_stu_code, tch, exam_id, stu.code, stu.id)
+        except Exception as e:
+            logger.warning(f"Failed to get rank of {stu.code} in {exam_id}: {e}")
+    if student is None:
+        students_scores_list = fetch_exam_scores(tch, exam_id, school_id)
+        student = students_scores_list.get_by_user_id(stu.id)
+        return format_student_scores(student) if student else None
+    if has_missing_rank(student):
+        # 上游未给出排名，后台抓取全部成绩并计算排名后再发送
+        crawl_exam_rank_in_background(qqid, tch, exam_id, school_id, stu.id)
+        return format_student_scores(student) + "部分排名正在计算，稍后将发送完整排名。"
+    return format_student_scores(student)
+
+
+def format_student_scores(student):
     returns = ""
-    for student in students_scores_list:
-        if student.user_id == stu.id:
-            for subject in student.scores:
-                returns += f"{subject}: {student.scores[subject].score} (班次 {student.scores[subject].classrank}" \
-                           f"/校次 {student.scores[subject].schoolrank})\n"
-            return returns
+    for subject in student.scores:
+        returns += f"{subject}: {student.scores[subject].score} (班次 {student.scores[subject].classrank}" \
+                   f"/校次 {student.scores[subject].schoolrank})\n"
+    return returns
 
 
-def get_exam_rank(qqid, exam_id: str):
-    """获得成绩单"""
-    stu_school = stu_list[qqid].clazz.school.id
-    global tch_list
-    if stu_school not in tch_list:
-        send_private_message(qqid, "暂不支持所在学校，请联系管理员。")
-        raise FailedGetTeacherAccountError
-    tch_list[stu_school] = update_login_status_self(tch_list[stu_school])
-    tch = tch_list[stu_school]
-    save_cache("tch_list", tch_list)
-    wb = Workbook()
-    ws = wb.active
-    subjects_list = get_exam_subjects(tch, exam_id)
-    global exam_scores
-    exam_scores = load_cache("exam_scores", "dict")
-    if exam_id in exam_scores:
-        students_scores_list = exam_scores[exam_id]
-    else:
-        students_scores_list = get_exam_all_rank(tch, exam_id)
-        exam_scores[exam_id] = students_scores_list
-        save_cache("exam_scores", exam_scores)
+def crawl_exam_rank_in_background(qqid, tch, exam_id, school_id, user_id):
+    """后台抓取全部成绩并计算排名，完成后将完整排名发送给用户"""
+    def run():
+        current_job.set(None)  # 后台抓取不属于发起它的任务，不向其汇报进度，也不随其取消
+        try:
+            students_scores_list = fetch_exam_scores(tch, exam_id, school_id)
+        except Exception:
+            logger.exception(f"Failed to get exam data in background: {exam_id}")
+            send_private_message(qqid, "排名计算失败，请稍后重试。")
+            return
+        student = students_scores_list.get_by_user_id(user_id)
+        if student:
+            send_private_message(qqid, "排名计算完成：\n" + format_student_scores(student))
+
+    # 复制上下文，使完成后的消息通过同一机器人发送
+    threading.Thread(target=contextvars.copy_context().run, args=(run,), name=f"crawl-{exam_id}", daemon=True).start()
+
+
+def iter_exam_rows(subjects_list, students_scores_list):
+    """逐行产出成绩单内容，第一行为表头"""
     titles = ["姓名", "标签", "班级", "总分", "总分班次", "总分校次"]
     for subject_code in subjects_list:
         subject_name = subjects_list[subject_code]["name"]
         titles.extend([subject_name + "成绩", subject_name + "班次", subject_name + "校次"])
-    ws.append(titles)
+    yield titles
     for student in students_scores_list:
         row = [student.username, student.label, student.class_name,
                student.scores["总分"].score, student.scores["总分"].classrank, student.scores["总分"].schoolrank]
@@ -225,52 +575,104 @@ def get_exam_rank(qqid, exam_id: str):
             subject_name = subjects_list[subject_code]["name"]
             row.extend([student.scores[subject_name].score, student.scores[subject_name].classrank,
                         student.scores[subject_name].schoolrank])
+        yield row
+
+
+def write_xlsx(file_name, rows):
+    from openpyxl import Workbook  # 仅导出成绩单时需要，延迟导入以加快启动
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    for row in rows:
         ws.append(row)
-    file_name = f"./.zx/cache/scores_{exam_id}_{time.time()}.xlsx"
     wb.save(file_name)
+
+
+def write_csv(file_name, rows):
+    with open(file_name, "w", encoding="utf-8-sig", newline="") as f:
+        csv.writer(f).writerows(rows)
+
+
+EXPORT_WRITERS = {"xlsx": write_xlsx, "csv": write_csv}
+
+
+def get_exam_rank(qqid, exam_id: str, file_format="xlsx"):
+    """
+    获得成绩单，同一考试数据未变化时复用已导出的文件
+    Args:
+        qqid: QQ 号
+        exam_id: 考试 ID
+        file_format: 文件格式，xlsx 或 csv
+    Return:
+        str: 成绩单文件路径
+    """
+    students_scores_list = get_exam_scores(qqid, exam_id)
+    file_name = f"./.zx/cache/scores_{exam_id}_{get_exam_scores_version(exam_id)}.{file_format}"
+    if cache_manager.lookup(file_name):
+        logger.info(f"Reused exported scores: {file_name}")
+        return file_name
+    # 相同成绩单同时只导出一次，避免并发写入同一临时文件
+    flights.do(("export", file_name), export_exam_rank, qqid, exam_id, students_scores_list, file_name, file_format)
     return file_name
 
 
+def export_exam_rank(qqid, exam_id, students_scores_list: ExamScoreTable, file_name, file_format):
+    if os.path.exists(file_name):  # 等待期间已由其他调用导出
+        return
+    tch = get_teacher(qqid)
+    subjects_list = call_with_relogin(tch, get_exam_subjects, tch, exam_id)
+    EXPORT_WRITERS[file_format](f"{file_name}.tmp", iter_exam_rows(subjects_list, students_scores_list))
+    os.replace(f"{file_name}.tmp", file_name)
+    cache_manager.add(file_name)
+    # 删除同一考试旧版本数据的导出文件
+    for old_file in glob.glob(f"./.zx/cache/scores_{exam_id}_*.{file_format}"):
+        if os.path.normpath(old_file) != os.path.normpath(file_name):
+            cache_manager.remove(old_file)
+
+
+def render_answersheet(tch, subject_id, stu_id, file_name):
+    if os.path.exists(file_name):  # 等待期间已由其他调用生成
+        return
+    image = process_answersheet(tch, subject_id, stu_id)
+    image.save(f"{file_name}.tmp", format="PNG")
+    os.replace(f"{file_name}.tmp", file_name)
+    cache_manager.add(file_name)
+
+
 def get_answersheet_by_stuid(qqid, stu_id, examid):
-    """通过 student_id 获取答题卡"""
-    stu_school = stu_list[qqid].clazz.school.id
-    global tch_list
-    if stu_school not in tch_list:
-        send_private_message(qqid, "暂不支持所在学校，请联系管理员。")
-        raise FailedGetTeacherAccountError
-    tch_list[stu_school] = update_login_status_self(tch_list[stu_school])
-    tch = tch_list[stu_school]
-    save_cache("tch_list", tch_list)
-    subject_list = get_exam_subjects(tch, examid)
-    images = []
-    for subject_code in subject_list:
-        subject_id = subject_list[subject_code]["id"]
+    """通过 student_id 获取答题卡，返回按生成完成顺序产出图片路径的生成器"""
+    tch = get_teacher(qqid)
+    subject_list = call_with_relogin(tch, get_exam_subjects, tch, examid)
+
+    def render(subject_id):
         file_name = f"./.zx/cache/answersheet_{subject_id}_{stu_id}.png"
-        if not os.path.exists(file_name):
+        if not cache_manager.lookup(file_name):
+            # 相同答题卡同时只生成一次
+            flights.do(("answersheet", subject_id, stu_id), render_answersheet, tch, subject_id, stu_id, file_name)
+        return file_name
+
+    # 各学科并行生成，生成完成一张即返回一张
+    with ThreadPoolExecutor(max_workers=answersheet_workers) as pool:
+        futures = [pool.submit(render, subject["id"]) for subject in subject_list.values()]
+        for future in as_completed(futures):
             try:
-                image = process_answersheet(tch, subject_id, stu_id)
+                yield future.result()
             except ZhixueError as e:
                 logger.warning(f"Failed to get answersheet: {e}")
-                continue
-            image.save(file_name)
-        images.append(file_name)
-    return images
 
 
 def get_answersheet_by_stuname(stu_name, qqid, examid):
     """通过 学生姓名 获取答题卡"""
-    stu_school = stu_list[qqid].clazz.school.id
-    global tch_list
-    if stu_school not in tch_list:
-        send_private_message(qqid, "暂不支持所在学校，请联系管理员。")
-        raise FailedGetTeacherAccountError
-    tch_list[stu_school] = update_login_status_self(tch_list[stu_school])
-    tch = tch_list[stu_school]
-    save_cache("tch_list", tch_list)
+    tch = get_teacher(qqid)
     stu, status = get_user(qqid)
     if not status:
         return None
-    stu_id = get_stuid_by_stuname(tch, examid, stu_name)
+    students_scores_list = get_cached_exam_scores(examid)
+    matched = students_scores_list.find_by_username(stu_name) if students_scores_list is not None else []
+    if matched:
+        stu_id = matched[0].user_id
+    else:
+        stu_id = call_with_relogin(tch, get_stuid_by_stuname, tch, examid, stu_name)
     return get_answersheet_by_stuid(qqid, stu_id, examid)
 
 